@@ -0,0 +1 @@
+# Lets tests import the backend modules (e.g. ``ocr``) from the repository root.
@@ -1,17 +1,27 @@
 import os
 import logging
-from typing import List, Dict, Any, Optional, Tuple
-from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Tuple, Iterator
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
 import hashlib
+import re
+import bisect
 import redis
+import redis.asyncio as aioredis
+import base64
+import io
+import gzip
+import tarfile
+from collections import OrderedDict
 from pathlib import Path
 import shutil
+import threading
+import time
 
 # FastAPI imports
-from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Depends
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Body, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
 app = FastAPI()
@@ -31,8 +41,7 @@ from sentence_transformers import SentenceTransformer, CrossEncoder
 import numpy as np
 
 # Vector storage and search
-import chromadb
-from chromadb.config import Settings
+from vector_store import ShardedVectorStore, create_vector_store
 
 # LLM integration
 from openai import OpenAI
@@ -40,10 +49,14 @@ import mistralai
 
 # MongoDB integration
 import motor.motor_asyncio
+from pymongo.errors import DuplicateKeyError
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+
+from rag_config import RAGConfig
+from ocr import OCRBackend, MistralOCRBackend, LocalOCRBackend, OCRCache, PageOCRRouter
 
 # --- CONFIGURATION ---
 logging.basicConfig(level=logging.INFO)
@@ -53,6 +66,11 @@ logger = logging.getLogger(__name__)
 KNOWLEDGEBASE_DIR = Path("Knowledgebase")
 KNOWLEDGEBASE_DIR.mkdir(exist_ok=True)
 PROCESSED_FILES_LOG = KNOWLEDGEBASE_DIR / "processed_files.log"
+# Which vector store the processed-file log describes; a different store starts from a fresh log
+PROCESSED_FILES_STORE = KNOWLEDGEBASE_DIR / "processed_files.store.json"
+SNAPSHOT_DIR = Path(os.getenv("SNAPSHOT_DIR", "snapshots"))
+# Snapshot bundle to restore on startup when the local index is empty (replica bootstrap)
+RESTORE_SNAPSHOT_PATH = os.getenv("RESTORE_SNAPSHOT_PATH")
 
 # MongoDB config
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
@@ -62,9 +80,15 @@ MONGO_USER_COLLECTION = os.getenv("MONGO_USER_COLLECTION", "users")
 SECRET_KEY = os.getenv("SECRET_KEY", "supersecretkey")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "4"))
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt is deliberately slow, so run it in a bounded pool instead of on the event loop
+auth_executor = ThreadPoolExecutor(max_workers=AUTH_HASH_WORKERS, thread_name_prefix="auth")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
+# Same scheme for endpoints that also serve anonymous callers: a missing token yields None instead of a 401
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login", auto_error=False)
 
 mongo_client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
 mongo_db = mongo_client[MONGO_DB]
@@ -90,17 +114,35 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password, hashed_password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(auth_executor, verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(auth_executor, get_password_hash, password)
+
 async def get_user(username: str):
+    """Load a user, serving repeat lookups from the short-TTL in-process cache"""
+    cached = user_cache.get(username)
+    if cached is not None:
+        return cached
     user = await user_collection.find_one({"username": username})
     if user:
-        return UserInDB(**user)
+        user = UserInDB(**user)
+        user_cache.set(username, user)
+        return user
     return None
 
+def invalidate_user(username: str):
+    """Drop a cached user, e.g. after their role changes"""
+    user_cache.delete(username)
+
 async def authenticate_user(username: str, password: str):
     user = await get_user(username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return False
     return user
 
@@ -132,60 +174,100 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
 async def get_current_active_user(current_user: UserInDB = Depends(get_current_user)):
     return current_user
 
+async def get_optional_user(token: Optional[str] = Depends(optional_oauth2_scheme)) -> Optional[UserInDB]:
+    """The signed-in user, or None for anonymous requests; a token that is sent must still be valid"""
+    if token is None:
+        return None
+    return await get_current_user(token)
+
 async def get_current_admin_user(current_user: UserInDB = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Not enough permissions")
     return current_user
 
-@dataclass
-class RAGConfig:
-    chunk_size: int = 500
-    chunk_overlap: int = 50
-    embedding_model: str = "all-MiniLM-L6-v2"
-    reranker_model: str = "BAAI/bge-reranker-base"
-    vector_dim: int = 384
-    top_k_retrieval: int = 20
-    top_k_rerank: int = 5
-    redis_host: str = "localhost"
-    redis_port: int = 6379
-    chroma_db_path: str = "./chroma_db"
-    chroma_collection_name: str = "document_chunks"
+def join_pages(page_texts: List[str]) -> str:
+    """Join per-page texts into one document text, skipping empty pages"""
+    return "".join(page_text + "\n" for page_text in page_texts if page_text)
+
+def assign_pages(chunks: List[Document], page_texts: List[str]):
+    """Set 1-based ``page`` metadata on chunks cut from ``join_pages(page_texts)``.
+
+    Each chunk is located by its leading words (whitespace-insensitive, since
+    semantic chunks re-join sentences) searching forward from the previous
+    chunk, so overlapping chunks resolve in order. Chunks that can't be
+    located are left without a page.
+    """
+    starts, page_numbers, position = [], [], 0
+    for number, page_text in enumerate(page_texts, start=1):
+        if page_text:
+            starts.append(position)
+            page_numbers.append(number)
+            position += len(page_text) + 1
+    text = join_pages(page_texts)
+
+    cursor = 0
+    for chunk in chunks:
+        if "page" in chunk.metadata:
+            continue
+        words = chunk.page_content.split()[:8]
+        if not words:
+            continue
+        match = re.compile(r"\s+".join(re.escape(word) for word in words)).search(text, cursor)
+        if match is None:
+            continue
+        cursor = match.start()
+        chunk.metadata["page"] = page_numbers[bisect.bisect_right(starts, cursor) - 1]
 
 class DocumentProcessor:
     """Handles document loading and initial processing with Mistral OCR integration"""
     
-    def __init__(self, mistral_api_key: str):
+    def __init__(self, mistral_api_key: str, config: Optional[RAGConfig] = None,
+                 ocr_backend: Optional[OCRBackend] = None):
+        self.config = config or RAGConfig()
         self.mistral_client = mistralai.Mistral(api_key=mistral_api_key)
+        if ocr_backend is not None:
+            self.ocr_backend = ocr_backend
+        elif self.config.ocr_backend == "mistral":
+            self.ocr_backend = MistralOCRBackend(self.mistral_client, self.config.ocr_model)
+        elif self.config.ocr_backend == "local":
+            self.ocr_backend = LocalOCRBackend()
+        else:
+            self.ocr_backend = None
+        self.ocr_router = PageOCRRouter(
+            self.ocr_backend,
+            OCRCache(self.config.ocr_cache_path),
+            min_text_chars=self.config.ocr_min_text_chars,
+            resolution=self.config.ocr_resolution,
+            max_concurrency=self.config.ocr_max_concurrency,
+            requests_per_second=self.config.ocr_requests_per_second,
+        )
         try:
             self.nlp = spacy.load("en_core_web_sm")
         except OSError:
             logger.warning("SpaCy model 'en_core_web_sm' not found. Using basic text processing.")
             self.nlp = None
     
-    def extract_with_mistral_ocr(self, file_path: str) -> str:
-        """Extract text using Mistral OCR capabilities"""
+    def extract_pages(self, file_path: str) -> List[str]:
+        """Extract text per page, sending only image-only pages to the OCR backend"""
         try:
-            # For demonstration - in practice, you'd use Mistral's vision/OCR API
-            with open(file_path, 'rb') as file:
-                # This would be replaced with actual Mistral OCR API call
-                # For now, using traditional PDF extraction as fallback
-                return self._extract_pdf_text(file_path)
+            with pdfplumber.open(file_path) as pdf:
+                return self.ocr_router.extract_pages(pdf.pages)
         except Exception as e:
             logger.error(f"Mistral OCR extraction failed: {e}")
-            return self._extract_pdf_text(file_path)
+            return self._extract_pdf_pages(file_path)
     
-    def _extract_pdf_text(self, file_path: str) -> str:
-        """Fallback PDF text extraction"""
-        text = ""
+    def extract_with_mistral_ocr(self, file_path: str) -> str:
+        """Extract text page by page, OCR'ing only pages without a usable text layer"""
+        return join_pages(self.extract_pages(file_path))
+    
+    def _extract_pdf_pages(self, file_path: str) -> List[str]:
+        """Fallback PDF text extraction, one text per page"""
         try:
             with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
+                return [page.extract_text() or "" for page in pdf.pages]
         except Exception as e:
             logger.error(f"PDF extraction failed: {e}")
-        return text
+            return []
     
     def extract_document_structure(self, file_path: str) -> Dict[str, Any]:
         """Extract hierarchical structure from PDF"""
@@ -361,8 +443,186 @@ class MultiResolutionIndexer:
         embeddings = self.embedding_model.encode(texts, show_progress_bar=True)
         return embeddings
 
+class LocalCache:
+    """Thread-safe in-process LRU cache with per-entry TTL"""
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def invalidate_prefix(self, prefix: str):
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class TieredCache:
+    """Two-tier cache: an in-process LRU/TTL tier in front of pooled Redis.
+
+    ``redis_client`` is a pooled synchronous client for pipeline code running in
+    worker threads; ``async_redis`` is a pooled asyncio client for request
+    handlers. While Redis is unreachable the cache keeps serving from the local
+    tier and retries Redis every ``redis_retry_interval`` seconds.
+    """
+    
+    def __init__(self, config: RAGConfig):
+        self.config = config
+        self.local = LocalCache(config.local_cache_size, config.local_cache_ttl)
+        self.redis_client = redis.Redis(connection_pool=redis.ConnectionPool(
+            host=config.redis_host,
+            port=config.redis_port,
+            decode_responses=True,
+            max_connections=config.redis_max_connections
+        ))
+        self.async_redis = aioredis.Redis(connection_pool=aioredis.ConnectionPool(
+            host=config.redis_host,
+            port=config.redis_port,
+            decode_responses=True,
+            max_connections=config.redis_max_connections
+        ))
+        self._retry_at = 0.0
+        self._invalidation_hooks: List[Any] = []
+        try:
+            self.redis_client.ping()
+            logger.info("Redis connection successful.")
+        except redis.RedisError as e:
+            self._mark_down(e)
+    
+    @property
+    def redis_available(self) -> bool:
+        return time.monotonic() >= self._retry_at
+    
+    def _mark_down(self, error: Exception):
+        if self.redis_available:
+            logger.warning(f"Redis unavailable, using local cache only for {self.config.redis_retry_interval}s: {error}")
+        self._retry_at = time.monotonic() + self.config.redis_retry_interval
+    
+    def get(self, key: str) -> Optional[Any]:
+        return self.get_many([key])[0]
+    
+    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        self.set_many({key: value}, ttl)
+    
+    def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        """Look keys up locally first, then fetch the misses from Redis in one MGET"""
+        values = [self.local.get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if not missing or not self.redis_available:
+            return values
+        try:
+            fetched = self.redis_client.mget([keys[i] for i in missing])
+        except redis.RedisError as e:
+            self._mark_down(e)
+            return values
+        for i, raw in zip(missing, fetched):
+            if raw is not None:
+                values[i] = json.loads(raw)
+                self.local.set(keys[i], values[i])
+        return values
+    
+    def set_many(self, items: Dict[str, Any], ttl: Optional[int] = None):
+        """Store values in both tiers, writing to Redis in a single pipeline"""
+        ttl = ttl or self.config.query_cache_ttl
+        for key, value in items.items():
+            self.local.set(key, value, min(ttl, self.local.ttl))
+        if not items or not self.redis_available:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key, value in items.items():
+                pipe.setex(key, ttl, json.dumps(value))
+            pipe.execute()
+        except redis.RedisError as e:
+            self._mark_down(e)
+    
+    def add_invalidation_hook(self, hook):
+        """Register ``hook(prefix)`` to be called whenever keys are invalidated"""
+        self._invalidation_hooks.append(hook)
+    
+    def invalidate(self, prefix: str = ""):
+        """Drop keys starting with ``prefix`` from both tiers"""
+        self.local.invalidate_prefix(prefix)
+        if prefix and self.redis_available:
+            try:
+                keys = list(self.redis_client.scan_iter(match=f"{prefix}*", count=500))
+                if keys:
+                    self.redis_client.unlink(*keys)
+            except redis.RedisError as e:
+                self._mark_down(e)
+        for hook in self._invalidation_hooks:
+            hook(prefix)
+
+def _encode_vector(vector: np.ndarray) -> str:
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+def _decode_vector(encoded: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(encoded), dtype=np.float32)
+
+def _epoch_seconds(value: datetime) -> int:
+    """Unix seconds for a datetime, reading naive values as UTC rather than server-local time"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+def build_scope_filter(sources: Optional[List[str]] = None, section: Optional[str] = None,
+                       page_from: Optional[int] = None, page_to: Optional[int] = None,
+                       ingested_after: Optional[datetime] = None, ingested_before: Optional[datetime] = None,
+                       tenant: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Translate query scoping options into a Chroma-style ``where`` filter"""
+    clauses = []
+    if sources:
+        clauses.append({"source": {"$in": list(sources)}})
+    if section:
+        clauses.append({"section_title": section})
+    if page_from is not None:
+        clauses.append({"page": {"$gte": page_from}})
+    if page_to is not None:
+        clauses.append({"page": {"$lte": page_to}})
+    if ingested_after is not None:
+        clauses.append({"ingested_at": {"$gte": _epoch_seconds(ingested_after)}})
+    if ingested_before is not None:
+        clauses.append({"ingested_at": {"$lte": _epoch_seconds(ingested_before)}})
+    if tenant:
+        clauses.append({"tenant": tenant})
+
+    if not clauses:
+        return None
+    # Chroma only accepts one top-level operator, so combine clauses with $and
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
 class AdvancedRetriever:
-    """Implements hybrid search, query expansion, and reranking with ChromaDB"""
+    """Implements hybrid search, query expansion, and reranking over a pluggable vector store"""
     
     def __init__(self, config: RAGConfig, openai_api_key: str):
         self.config = config
@@ -370,79 +630,57 @@ class AdvancedRetriever:
         self.embedding_model = SentenceTransformer(config.embedding_model)
         self.reranker = CrossEncoder(config.reranker_model)
         
-        # Initialize ChromaDB
-        self.chroma_client = chromadb.PersistentClient(
-            path=config.chroma_db_path,
-            settings=Settings(
-                anonymized_telemetry=False
-            )
-        )
-        
-        # Get or create collection
-        self.collection = self.chroma_client.get_or_create_collection(
-            name=config.chroma_collection_name
-        )
-        logger.info(f"Initialized ChromaDB collection: {config.chroma_collection_name}")
+        self.vector_store = create_vector_store(config)
         
-        # Initialize Redis for caching
-        try:
-            self.redis_client = redis.Redis(
-                host=config.redis_host,
-                port=config.redis_port,
-                decode_responses=True
-            )
-            self.redis_client.ping()
-            logger.info("Redis connection successful.")
-        except Exception as e:
-            self.redis_client = None
-            logger.warning(f"Redis connection failed, caching disabled: {e}")
+        # Two-tier cache (in-process LRU in front of Redis)
+        self.cache = TieredCache(config)
             
-    def build_index(self, chunks: List[Document], embeddings: np.ndarray, file_hashes: List[str]):
-        """Build ChromaDB vector index, avoiding duplicates."""
+    @staticmethod
+    def make_chunk_id(file_hash: str, position: int, text: str, tenant: str = "default") -> str:
+        chunk_hash = hashlib.md5(text.encode()).hexdigest()
+        # Default-tenant ids keep their original form so existing indexes stay valid
+        prefix = file_hash if tenant == "default" else f"{tenant}_{file_hash}"
+        return f"chunk_{prefix}_{position}_{chunk_hash}"
+
+    def build_index(self, chunks: List[Document], embeddings: np.ndarray, file_hashes: List[str],
+                    chunk_ids: Optional[List[str]] = None):
+        """Add chunks to the vector index, avoiding duplicates."""
         logger.info(f"Building index for {len(chunks)} new chunks")
         
-        # Prepare data for ChromaDB
-        documents, metadatas, ids, embeddings_list = [], [], [], []
+        documents, metadatas, ids = [], [], []
         
-        for i, (chunk, embedding, file_hash) in enumerate(zip(chunks, embeddings, file_hashes)):
-            chunk_hash = hashlib.md5(chunk.page_content.encode()).hexdigest()
-            chunk_id = f"chunk_{file_hash}_{i}_{chunk_hash}"
+        for i, (chunk, file_hash) in enumerate(zip(chunks, file_hashes)):
+            chunk_id = chunk_ids[i] if chunk_ids else self.make_chunk_id(file_hash, i, chunk.page_content)
             
             ids.append(chunk_id)
             documents.append(chunk.page_content)
-            
-            metadata = {
+            metadatas.append({
                 "file_hash": file_hash,
-                "chunk_index": str(i),
-                **{k: str(v) for k, v in chunk.metadata.items()}
-            }
-            metadatas.append(metadata)
-            embeddings_list.append(embedding.tolist())
+                "chunk_index": i,
+                **chunk.metadata,
+                # Stored so scoped queries can also select chunks by id (see ChunkDeduplicator)
+                "chunk_id": chunk_id,
+            })
         
         if not ids:
             logger.info("No new chunks to add to the index.")
             return
 
         try:
-            self.collection.add(
-                embeddings=embeddings_list,
-                documents=documents,
-                metadatas=metadatas,
-                ids=ids
-            )
-            logger.info(f"Successfully added {len(chunks)} chunks to ChromaDB")
+            # Embeddings go to the store as one ndarray; no per-row list conversion
+            added = self.vector_store.add(ids, embeddings, documents, metadatas)
+            logger.info(f"Successfully added {added} chunks to the {self.vector_store.name} vector store")
         except Exception as e:
-            logger.error(f"ChromaDB indexing failed: {e}")
+            logger.error(f"Vector store indexing failed: {e}")
             raise
     
     def expand_query(self, query: str) -> List[str]:
         """Generate expanded queries using LLM"""
         cache_key = f"query_expansion:{hashlib.md5(query.encode()).hexdigest()}"
         
-        if self.redis_client:
-            cached = self.redis_client.get(cache_key)
-            if cached:
-                return json.loads(cached)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
         
         try:
             response = self.openai_client.chat.completions.create(
@@ -455,80 +693,332 @@ class AdvancedRetriever:
             )
             expanded_queries = json.loads(response.choices[0].message.content)
             
-            if self.redis_client:
-                self.redis_client.setex(cache_key, 3600, json.dumps(expanded_queries))
+            self.cache.set(cache_key, expanded_queries)
             
             return expanded_queries
         except Exception as e:
             logger.error(f"Query expansion failed: {e}")
             return [query]
     
-    def vector_search(self, query: str, k: int = None) -> List[Tuple[Document, float]]:
-        """Perform vector similarity search using ChromaDB"""
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Encode queries, reusing cached embeddings and encoding only the misses in one pass"""
+        keys = [f"query_embedding:{self.config.embedding_model}:{hashlib.md5(q.encode()).hexdigest()}" for q in queries]
+        cached = self.cache.get_many(keys)
+        missing = [i for i, value in enumerate(cached) if value is None]
+        
+        vectors: List[Optional[np.ndarray]] = [None if value is None else _decode_vector(value) for value in cached]
+        if missing:
+            encoded = self.embedding_model.encode([queries[i] for i in missing])
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+            self.cache.set_many({keys[i]: _encode_vector(vector) for i, vector in zip(missing, encoded)})
+        return np.vstack(vectors).astype(np.float32, copy=False)
+
+    def vector_search(self, query: str, k: int = None,
+                      where: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """Perform vector similarity search for a single query"""
+        return self.vector_search_batch([query], k, where)[0]
+
+    def vector_search_batch(self, queries: List[str], k: int = None,
+                            where: Optional[Dict[str, Any]] = None) -> List[List[Tuple[Document, float]]]:
+        """Encode all queries in one pass and run a single batched top-k search.
+
+        ``where`` is pushed down into the vector store so only chunks in scope
+        are scored; see ``build_scope_filter``.
+        """
+        try:
+            query_embeddings = self.embed_queries(queries)
+        except Exception as e:
+            logger.error(f"Query encoding failed: {e}")
+            return [[] for _ in queries]
+        return self.search_embeddings(query_embeddings, k, where)
+
+    def search_embeddings(self, query_embeddings: np.ndarray, k: int = None,
+                          where: Optional[Dict[str, Any]] = None) -> List[List[Tuple[Document, float]]]:
+        """Batched top-k search for already-encoded queries"""
         k = k or self.config.top_k_retrieval
         
         try:
-            query_embedding = self.embedding_model.encode([query]).tolist()
-            results = self.collection.query(
-                query_embeddings=query_embedding,
-                n_results=k,
-                include=["documents", "metadatas", "distances"]
-            )
+            batched_hits = self.vector_store.query(query_embeddings, k, where)
             
-            search_results = []
-            if results["documents"]:
-                for doc_text, metadata, distance in zip(results["documents"][0], results["metadatas"][0], results["distances"][0]):
-                    doc = Document(page_content=doc_text, metadata=metadata)
-                    similarity_score = 1.0 / (1.0 + distance)
-                    search_results.append((doc, similarity_score))
-            
-            return search_results
+            return [
+                [(Document(page_content=doc_text, metadata={**metadata, "chunk_id": chunk_id}), 1.0 / (1.0 + distance))
+                 for chunk_id, doc_text, metadata, distance in hits]
+                for hits in batched_hits
+            ]
         except Exception as e:
-            logger.error(f"ChromaDB vector search failed: {e}")
+            logger.error(f"Vector search failed: {e}")
+            return [[] for _ in range(len(query_embeddings))]
+
+    def get_chunks(self, chunk_ids: List[str]) -> List[Tuple[Document, float]]:
+        """Load previously retrieved chunks by id (with a neutral score) for re-ranking"""
+        try:
+            return [(Document(page_content=doc_text, metadata={**metadata, "chunk_id": chunk_id}), 0.0)
+                    for chunk_id, doc_text, metadata in self.vector_store.get(chunk_ids)]
+        except Exception as e:
+            logger.error(f"Chunk lookup failed: {e}")
             return []
 
     def rerank_results(self, query: str, results: List[Tuple[Document, float]]) -> List[Tuple[Document, float]]:
         """Rerank results using cross-encoder"""
-        if not results:
-            return []
+        return self.rerank_results_batch([query], [results])[0]
+
+    def rerank_results_batch(self, queries: List[str],
+                             results_per_query: List[List[Tuple[Document, float]]]) -> List[List[Tuple[Document, float]]]:
+        """Rerank candidates for several queries with shared cross-encoder batches"""
+        pairs = [(query, doc.page_content) for query, results in zip(queries, results_per_query) for doc, _ in results]
+        if not pairs:
+            return [[] for _ in queries]
         
         try:
-            pairs = [(query, doc.page_content) for doc, _ in results]
-            rerank_scores = self.reranker.predict(pairs)
-            
-            reranked_results = [(doc, float(rerank_score)) for (doc, _), rerank_score in zip(results, rerank_scores)]
-            reranked_results.sort(key=lambda x: x[1], reverse=True)
-            
-            return reranked_results[:self.config.top_k_rerank]
+            rerank_scores = self.reranker.predict(pairs, batch_size=self.config.rerank_batch_size)
         except Exception as e:
             logger.error(f"Reranking failed: {e}")
-            return results[:self.config.top_k_rerank]
+            return [results[:self.config.top_k_rerank] for results in results_per_query]
+        
+        reranked_batches, offset = [], 0
+        for results in results_per_query:
+            scores = rerank_scores[offset:offset + len(results)]
+            offset += len(results)
+            reranked_results = [(doc, float(rerank_score)) for (doc, _), rerank_score in zip(results, scores)]
+            reranked_results.sort(key=lambda x: x[1], reverse=True)
+            reranked_batches.append(reranked_results[:self.config.top_k_rerank])
+        return reranked_batches
 
     def get_collection_stats(self) -> Dict[str, Any]:
-        """Get statistics about the ChromaDB collection"""
+        """Get statistics about the vector store"""
         try:
-            count = self.collection.count()
-            return {
+            count = self.vector_store.count()
+            stats = {
                 "total_chunks": count,
+                "backend": self.vector_store.name,
                 "collection_name": self.config.chroma_collection_name,
                 "embedding_model": self.config.embedding_model
             }
+            if isinstance(self.vector_store, ShardedVectorStore):
+                stats["shard_chunks"] = self.vector_store.shard_counts()
+            return stats
         except Exception as e:
             logger.error(f"Failed to get collection stats: {e}")
             return {}
     
     def reset_collection(self):
-        """Delete and recreate the ChromaDB collection"""
+        """Delete and recreate the vector store contents"""
         try:
-            self.chroma_client.delete_collection(name=self.config.chroma_collection_name)
-            self.collection = self.chroma_client.create_collection(
-                name=self.config.chroma_collection_name,
-                metadata={"description": "Document chunks for RAG system"}
-            )
-            logger.info(f"Successfully reset ChromaDB collection: {self.config.chroma_collection_name}")
+            self.vector_store.reset()
+            logger.info(f"Successfully reset {self.vector_store.name} vector store")
         except Exception as e:
             logger.error(f"Failed to reset collection: {e}")
 
+class ChunkDeduplicator:
+    """Detects exact and near-duplicate chunks at ingest using content hashes and MinHash/LSH.
+
+    Each distinct chunk is indexed once per tenant; every copy found later in
+    the same tenant is recorded as an extra source reference on the first
+    (canonical) chunk, and ``matching_canonical_ids`` lets scoped queries reach
+    the canonical chunk through those references. State lives under
+    ``config.dedupe_index_path`` so duplicates of already-indexed chunks are
+    caught across ingest runs.
+    """
+    
+    _HASH_PRIME = 4294967311  # smallest prime above 2**32
+    
+    def __init__(self, config: RAGConfig):
+        self.config = config
+        self.path = Path(config.dedupe_index_path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.rows_per_band = config.minhash_num_perm // config.minhash_bands
+        rng = np.random.default_rng(1)
+        self._perm_a = rng.integers(1, 1 << 31, size=config.minhash_num_perm, dtype=np.uint64)
+        self._perm_b = rng.integers(0, 1 << 32, size=config.minhash_num_perm, dtype=np.uint64)
+        self._load()
+    
+    def _clear_state(self):
+        self._ids: List[str] = []
+        self._tenants: List[str] = []
+        self._signatures: List[np.ndarray] = []
+        self._exact: Dict[str, str] = {}
+        self._references: Dict[str, List[Dict[str, Any]]] = {}
+        self._buckets: Dict[Tuple[str, int, bytes], List[int]] = {}
+        # Copies stored only as references, by source: source -> [(canonical id, reference)]
+        self._duplicates_by_source: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+    
+    def _load(self):
+        self._clear_state()
+        state_path = self.path / "dedupe.json"
+        signatures_path = self.path / "minhash.npy"
+        if not state_path.exists() or not signatures_path.exists():
+            return
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        signatures = np.load(signatures_path)
+        if len(signatures) != len(state["ids"]):
+            logger.warning("Dedupe index is inconsistent; starting with an empty one.")
+            return
+        self.import_state(state, signatures)
+    
+    def export_state(self) -> Tuple[Dict[str, Any], np.ndarray]:
+        signatures = np.array(self._signatures, dtype=np.uint64).reshape(-1, self.config.minhash_num_perm)
+        return {"ids": self._ids, "tenants": self._tenants, "exact": self._exact,
+                "references": self._references}, signatures
+    
+    def import_state(self, state: Dict[str, Any], signatures: np.ndarray):
+        self._clear_state()
+        self._exact = state["exact"]
+        self._references = state["references"]
+        tenants = state.get("tenants", ["default"] * len(state["ids"]))
+        for chunk_id, tenant, signature in zip(state["ids"], tenants, signatures):
+            self._register(chunk_id, tenant, signature)
+        for canonical_id, references in self._references.items():
+            for reference in references:
+                self._add_duplicate(canonical_id, reference)
+    
+    def save(self):
+        state, signatures = self.export_state()
+        np.save(self.path / "minhash.npy", signatures)
+        tmp_path = self.path / "dedupe.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path / "dedupe.json")
+    
+    def reset(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._clear_state()
+    
+    def discard_changes(self):
+        """Drop registrations made since the last ``save``"""
+        self._load()
+    
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return " ".join(text.lower().split())
+    
+    def _signature(self, normalized: str) -> np.ndarray:
+        words = normalized.split()
+        size = self.config.shingle_size
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") for s in shingles),
+            dtype=np.uint64, count=len(shingles)
+        )
+        permuted = (hashes[:, None] * self._perm_a + self._perm_b) % np.uint64(self._HASH_PRIME)
+        return permuted.min(axis=0)
+    
+    def _bands(self, signature: np.ndarray):
+        for band in range(self.config.minhash_bands):
+            start = band * self.rows_per_band
+            yield band, signature[start:start + self.rows_per_band].tobytes()
+    
+    def _register(self, chunk_id: str, tenant: str, signature: np.ndarray):
+        position = len(self._ids)
+        self._ids.append(chunk_id)
+        self._tenants.append(tenant)
+        self._signatures.append(signature)
+        for band_key in self._bands(signature):
+            self._buckets.setdefault((tenant, *band_key), []).append(position)
+    
+    def _add_duplicate(self, canonical_id: str, reference: Dict[str, Any]):
+        if reference["chunk_id"] != canonical_id:
+            self._duplicates_by_source.setdefault(reference["source"], []).append((canonical_id, reference))
+    
+    def _find_near_duplicate(self, tenant: str, signature: np.ndarray) -> Optional[str]:
+        candidates = set()
+        for band_key in self._bands(signature):
+            candidates.update(self._buckets.get((tenant, *band_key), ()))
+        best_id, best_similarity = None, self.config.dedupe_threshold
+        for position in candidates:
+            similarity = float(np.mean(self._signatures[position] == signature))
+            if similarity >= best_similarity:
+                best_id, best_similarity = self._ids[position], similarity
+        return best_id
+    
+    def deduplicate(self, chunk_ids: List[str], chunks: List[Document]) -> Tuple[List[int], Dict[str, int]]:
+        """Return the positions of chunks that still need indexing and a dedupe report"""
+        keep = []
+        exact_duplicates = near_duplicates = 0
+        
+        for position, (chunk_id, chunk) in enumerate(zip(chunk_ids, chunks)):
+            tenant = chunk.metadata.get("tenant", "default")
+            reference = {
+                "chunk_id": chunk_id,
+                "source": chunk.metadata.get("source", "unknown"),
+                "page": chunk.metadata.get("page"),
+                "section_title": chunk.metadata.get("section_title"),
+                "tenant": tenant,
+                "ingested_at": chunk.metadata.get("ingested_at"),
+            }
+            normalized = self._normalize(chunk.page_content)
+            # Tenants are isolated, so the same text in two tenants is indexed twice
+            content_key = f"{tenant}:{hashlib.md5(normalized.encode()).hexdigest()}"
+            
+            canonical_id = self._exact.get(content_key)
+            if canonical_id is not None:
+                exact_duplicates += 1
+            else:
+                signature = self._signature(normalized)
+                canonical_id = self._find_near_duplicate(tenant, signature)
+                if canonical_id is not None:
+                    near_duplicates += 1
+                    self._exact[content_key] = canonical_id
+                else:
+                    self._exact[content_key] = chunk_id
+                    self._register(chunk_id, tenant, signature)
+                    keep.append(position)
+                    canonical_id = chunk_id
+            self._references.setdefault(canonical_id, []).append(reference)
+            self._add_duplicate(canonical_id, reference)
+        
+        report = {
+            "total_chunks": len(chunks),
+            "indexed_chunks": len(keep),
+            "exact_duplicates": exact_duplicates,
+            "near_duplicates": near_duplicates,
+        }
+        return keep, report
+    
+    def references(self, chunk_id: str) -> List[Dict[str, Any]]:
+        """All source references that map to an indexed chunk"""
+        return self._references.get(chunk_id, [])
+    
+    def matching_canonical_ids(self, scope: Dict[str, Any]) -> List[str]:
+        """Indexed chunks with a deduplicated copy that satisfies ``scope``.
+
+        ``scope`` takes the ``build_scope_filter`` arguments. The vector store
+        only holds each canonical chunk's own metadata, so copies from other
+        files are matched here and added to the query filter by chunk id.
+        """
+        sources = scope.get("sources")
+        if sources:
+            duplicates = [d for source in sources for d in self._duplicates_by_source.get(source, ())]
+        else:
+            duplicates = [d for per_source in self._duplicates_by_source.values() for d in per_source]
+        
+        after, before = scope.get("ingested_after"), scope.get("ingested_before")
+        checks = []
+        if scope.get("tenant"):
+            checks.append(lambda ref: ref.get("tenant") == scope["tenant"])
+        if scope.get("page_from") is not None:
+            checks.append(lambda ref: ref.get("page") is not None and ref["page"] >= scope["page_from"])
+        if scope.get("page_to") is not None:
+            checks.append(lambda ref: ref.get("page") is not None and ref["page"] <= scope["page_to"])
+        if after is not None:
+            checks.append(lambda ref: ref.get("ingested_at") is not None and ref["ingested_at"] >= _epoch_seconds(after))
+        if before is not None:
+            checks.append(lambda ref: ref.get("ingested_at") is not None and ref["ingested_at"] <= _epoch_seconds(before))
+        
+        matches = {canonical_id for canonical_id, reference in duplicates
+                   if all(check(reference) for check in checks)}
+        return sorted(matches)
+    
+    def get_stats(self) -> Dict[str, int]:
+        total_references = sum(len(refs) for refs in self._references.values())
+        return {
+            "unique_chunks": len(self._ids),
+            "total_references": total_references,
+            "deduplicated_chunks": total_references - len(self._ids),
+        }
+
 class ContextOptimizer:
     """Handles context compression and iterative retrieval"""
     
@@ -562,39 +1052,91 @@ class ContextOptimizer:
             logger.error(f"Context compression failed: {e}")
             return "\n".join(contexts)
 
+SNAPSHOT_FORMAT_VERSION = 1
+
+def _npy_bytes(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
 class RAGPipeline:
     """Main RAG pipeline orchestrating all components"""
     
     def __init__(self, config: RAGConfig, mistral_api_key: str, openai_api_key: str):
         self.config = config
-        self.document_processor = DocumentProcessor(mistral_api_key)
+        self.document_processor = DocumentProcessor(mistral_api_key, config)
         self.chunker = IntelligentChunker(config)
         self.indexer = MultiResolutionIndexer(config, openai_api_key)
         self.retriever = AdvancedRetriever(config, openai_api_key)
+        self.deduplicator = ChunkDeduplicator(config) if config.dedupe_enabled else None
+        self.last_dedupe_report: Dict[str, int] = {}
         self.context_optimizer = ContextOptimizer(config, openai_api_key)
         self.openai_client = OpenAI(api_key=openai_api_key)
         
         self.processed_hashes = self._load_processed_hashes()
         self.is_indexed = self.retriever.get_collection_stats().get("total_chunks", 0) > 0
+        # Serialises ingest against snapshot export/restore so bundles are consistent
+        self._index_lock = threading.RLock()
 
     def _load_processed_hashes(self) -> set:
-        """Load the set of hashes of already processed files."""
-        if not PROCESSED_FILES_LOG.exists():
-            return set()
-        with open(PROCESSED_FILES_LOG, "r") as f:
-            return set(line.strip() for line in f)
-
-    def _mark_file_as_processed(self, file_hash: str):
-        """Add a file hash to the processed log."""
-        self.processed_hashes.add(file_hash)
+        """Load the set of hashes of already processed files, if the log belongs to the configured store.
+
+        If the log was written for another backend, path or shard layout, or
+        lists files while the store is empty, it is discarded (with the dedupe
+        registry) so the startup scan re-ingests every document.
+        """
+        vector_store = self.retriever.vector_store
+        store = vector_store.describe()
+        recorded = None
+        if PROCESSED_FILES_STORE.exists():
+            with open(PROCESSED_FILES_STORE, "r") as f:
+                recorded = json.load(f)
+        hashes = set()
+        if PROCESSED_FILES_LOG.exists():
+            with open(PROCESSED_FILES_LOG, "r") as f:
+                hashes = set(self._processed_key_from_line(line) for line in f if line.strip())
+        
+        chunk_count = vector_store.count()
+        if hashes and ((recorded is not None and recorded != store) or chunk_count == 0):
+            logger.warning(f"Processed-file log lists {len(hashes)} files for store {recorded}, but the configured "
+                           f"store is {store} with {chunk_count} chunks; all documents will be re-ingested.")
+            os.remove(PROCESSED_FILES_LOG)
+            hashes = set()
+            if self.deduplicator is not None:
+                self.deduplicator.reset()
+        if recorded != store:
+            with open(PROCESSED_FILES_STORE, "w") as f:
+                json.dump(store, f)
+        return hashes
+
+    @staticmethod
+    def _processed_key(tenant: str, file_hash: str) -> str:
+        """Processed-log entry for a file; the same file is ingested separately for each tenant"""
+        return f"{tenant}:{file_hash}"
+
+    @classmethod
+    def _processed_key_from_line(cls, line: str) -> str:
+        # Logs written before tenants existed hold bare hashes, all ingested as "default"
+        line = line.strip()
+        return line if ":" in line else cls._processed_key("default", line)
+
+    def _mark_file_as_processed(self, processed_key: str):
+        """Add a (tenant, file hash) key to the processed log."""
+        self.processed_hashes.add(processed_key)
         with open(PROCESSED_FILES_LOG, "a") as f:
-            f.write(f"{file_hash}\n")
+            f.write(f"{processed_key}\n")
 
-    def process_documents(self, file_paths: List[str], use_semantic_chunking: bool = False) -> int:
+    def process_documents(self, file_paths: List[str], use_semantic_chunking: bool = False,
+                          tenant: str = "default") -> int:
         """Process a list of documents and update the index."""
+        with self._index_lock:
+            return self._process_documents(file_paths, use_semantic_chunking, tenant)
+
+    def _process_documents(self, file_paths: List[str], use_semantic_chunking: bool, tenant: str) -> int:
         all_chunks = []
         all_file_hashes = []
-        new_files_processed = 0
+        new_file_hashes = []
+        self.last_dedupe_report = {}
 
         for file_path in file_paths:
             path = Path(file_path)
@@ -605,13 +1147,14 @@ class RAGPipeline:
             with open(path, "rb") as f:
                 file_hash = hashlib.md5(f.read()).hexdigest()
             
-            if file_hash in self.processed_hashes:
-                logger.info(f"Skipping already processed file: {path.name}")
+            if self._processed_key(tenant, file_hash) in self.processed_hashes or file_hash in new_file_hashes:
+                logger.info(f"Skipping file already processed for tenant {tenant}: {path.name}")
                 continue
 
             logger.info(f"Processing new document: {path.name}")
             
-            text = self.document_processor.extract_with_mistral_ocr(file_path)
+            page_texts = self.document_processor.extract_pages(file_path)
+            text = join_pages(page_texts)
             structure = self.document_processor.extract_document_structure(file_path)
             
             if use_semantic_chunking:
@@ -619,60 +1162,381 @@ class RAGPipeline:
             else:
                 chunks = self.chunker.hierarchical_chunk(text, structure)
             
+            assign_pages(chunks, page_texts)
+            ingested_at = int(time.time())
             for chunk in chunks:
                 chunk.metadata['source'] = path.name
+                chunk.metadata['tenant'] = tenant
+                chunk.metadata['ingested_at'] = ingested_at
             
             all_chunks.extend(chunks)
             all_file_hashes.extend([file_hash] * len(chunks))
-            self._mark_file_as_processed(file_hash)
-            new_files_processed += 1
+            new_file_hashes.append(file_hash)
 
         if not all_chunks:
+            for file_hash in new_file_hashes:
+                self._mark_file_as_processed(self._processed_key(tenant, file_hash))
             logger.info("No new documents to process.")
             return 0
             
-        logger.info(f"Created {len(all_chunks)} chunks from {new_files_processed} new documents.")
+        logger.info(f"Created {len(all_chunks)} chunks from {len(new_file_hashes)} new documents.")
+        
+        chunk_ids = [self.retriever.make_chunk_id(file_hash, i, chunk.page_content, tenant)
+                     for i, (chunk, file_hash) in enumerate(zip(all_chunks, all_file_hashes))]
         
-        embeddings = self.indexer.create_embeddings(all_chunks)
-        self.retriever.build_index(all_chunks, embeddings, all_file_hashes)
+        try:
+            # Drop exact and near-duplicate chunks before spending encoder time on them
+            if self.deduplicator is not None:
+                keep, self.last_dedupe_report = self.deduplicator.deduplicate(chunk_ids, all_chunks)
+                logger.info(f"Deduplication report: {self.last_dedupe_report}")
+                all_chunks = [all_chunks[i] for i in keep]
+                all_file_hashes = [all_file_hashes[i] for i in keep]
+                chunk_ids = [chunk_ids[i] for i in keep]
+            
+            if all_chunks:
+                embeddings = self.indexer.create_embeddings(all_chunks)
+                self.retriever.build_index(all_chunks, embeddings, all_file_hashes, chunk_ids)
+        except Exception:
+            # The registry now names canonical chunks that never reached the index; go back to the saved one
+            if self.deduplicator is not None:
+                self.deduplicator.discard_changes()
+            raise
+        if self.deduplicator is not None:
+            self.deduplicator.save()
+        # Files count as processed only once their chunks are indexed, so a failed ingest is retried
+        for file_hash in new_file_hashes:
+            self._mark_file_as_processed(self._processed_key(tenant, file_hash))
         
         self.is_indexed = True
         logger.info("Document processing and indexing complete.")
-        return new_files_processed
+        return len(new_file_hashes)
 
-    def query(self, question: str, use_iterative_retrieval: bool = False) -> Dict[str, Any]:
-        """Process a query and generate response"""
+    def export_snapshot(self, path: str) -> Dict[str, Any]:
+        """Write a consistent, versioned snapshot bundle of the index to ``path``.
+
+        The bundle is an uncompressed tar holding a manifest, float16
+        embeddings, gzipped chunk records, the processed-file manifest and the
+        dedupe registry. There is no lexical or summary index to include yet.
+        """
+        with self._index_lock:
+            ids, embeddings, documents, metadatas = self.retriever.vector_store.export_all()
+            records = "".join(
+                json.dumps({"id": chunk_id, "document": document, "metadata": metadata}) + "\n"
+                for chunk_id, document, metadata in zip(ids, documents, metadatas)
+            )
+            members = {
+                "embeddings.npy": _npy_bytes(np.asarray(embeddings, dtype=np.float16)),
+                "records.jsonl.gz": gzip.compress(records.encode("utf-8")),
+                "processed_files.log": "".join(f"{h}\n" for h in sorted(self.processed_hashes)).encode(),
+            }
+            if self.deduplicator is not None:
+                dedupe_state, signatures = self.deduplicator.export_state()
+                members["dedupe.json"] = json.dumps(dedupe_state).encode("utf-8")
+                members["minhash.npy"] = _npy_bytes(signatures)
+            manifest = {
+                "format_version": SNAPSHOT_FORMAT_VERSION,
+                "created_at": datetime.utcnow().isoformat(),
+                "embedding_model": self.config.embedding_model,
+                "vector_dim": int(embeddings.shape[1]),
+                "chunk_count": len(ids),
+                "source_backend": self.retriever.vector_store.name,
+                "members": sorted(members),
+            }
+            members["manifest.json"] = json.dumps(manifest, indent=2).encode("utf-8")
+
+            target = Path(path)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = target.with_suffix(target.suffix + ".tmp")
+            with tarfile.open(tmp_path, "w") as tar:
+                for name in ["manifest.json"] + manifest["members"]:
+                    info = tarfile.TarInfo(name)
+                    info.size = len(members[name])
+                    info.mtime = int(time.time())
+                    tar.addfile(info, io.BytesIO(members[name]))
+            os.replace(tmp_path, target)
+        logger.info(f"Exported snapshot with {len(ids)} chunks to {target}")
+        return manifest
+
+    def restore_snapshot(self, path: str) -> Dict[str, Any]:
+        """Replace the index, processed-file manifest and dedupe registry from a snapshot bundle"""
+        with tarfile.open(path, "r") as tar:
+            def read(name: str) -> bytes:
+                return tar.extractfile(name).read()
+
+            manifest = json.loads(read("manifest.json"))
+            if manifest["format_version"] > SNAPSHOT_FORMAT_VERSION:
+                raise ValueError(f"Snapshot format {manifest['format_version']} is newer than supported ({SNAPSHOT_FORMAT_VERSION})")
+            if manifest["embedding_model"] != self.config.embedding_model:
+                raise ValueError(f"Snapshot was built with {manifest['embedding_model']}, "
+                                 f"but this instance uses {self.config.embedding_model}")
+
+            embeddings = np.load(io.BytesIO(read("embeddings.npy")))
+            records = [json.loads(line) for line in gzip.decompress(read("records.jsonl.gz")).decode("utf-8").splitlines()]
+            processed = [self._processed_key_from_line(line)
+                         for line in read("processed_files.log").decode().splitlines() if line.strip()]
+            dedupe = None
+            if "dedupe.json" in manifest["members"]:
+                dedupe = (json.loads(read("dedupe.json")), np.load(io.BytesIO(read("minhash.npy"))))
+
+        if len(records) != len(embeddings) or len(records) != manifest["chunk_count"]:
+            raise ValueError("Snapshot is corrupt: chunk records and embeddings disagree")
+
+        with self._index_lock:
+            # The snapshot loads into a staging store; the live index, processed-file log and
+            # dedupe registry are only replaced once it has loaded, so a failure changes nothing
+            self.retriever.vector_store.replace_all(
+                [r["id"] for r in records],
+                embeddings,
+                [r["document"] for r in records],
+                [r["metadata"] for r in records]
+            )
+            tmp_log = PROCESSED_FILES_LOG.with_suffix(".tmp")
+            with open(tmp_log, "w") as f:
+                f.writelines(f"{h}\n" for h in processed)
+            os.replace(tmp_log, PROCESSED_FILES_LOG)
+            self.processed_hashes = set(processed)
+            if self.deduplicator is not None:
+                if dedupe is not None:
+                    self.deduplicator.import_state(*dedupe)
+                else:
+                    self.deduplicator.reset()
+                self.deduplicator.save()
+            self.is_indexed = len(records) > 0
+        logger.info(f"Restored snapshot with {len(records)} chunks from {path}")
+        return manifest
+
+    def rebuild_shard(self, shard: int):
+        """Rebuild one shard of a sharded vector store, serialised with ingest and restores"""
+        vector_store = self.retriever.vector_store
+        if not isinstance(vector_store, ShardedVectorStore):
+            raise ValueError("The vector store is not sharded.")
+        with self._index_lock:
+            vector_store.rebuild_shard(shard)
+        logger.info(f"Rebuilt shard {shard} with {vector_store.shards[shard].count()} chunks")
+
+    def query(self, question: str, use_iterative_retrieval: bool = False,
+              scope: Optional[Dict[str, Any]] = None, session_id: Optional[str] = None,
+              username: Optional[str] = None) -> Dict[str, Any]:
+        """Process a query and generate response.
+
+        ``scope`` takes the keyword arguments of ``build_scope_filter`` and
+        restricts retrieval to matching chunks inside the index. With a
+        ``session_id`` and the ``username`` that owns it, follow-up questions
+        reuse the previous turn's retrieval instead of running the full
+        pipeline again.
+        """
         if not self.is_indexed:
             raise ValueError("No documents have been indexed yet.")
         
         logger.info(f"Processing query: {question}")
         
+        where = self._scope_filter(scope)
+        # Sessions are namespaced by user so one caller cannot pick up another's conversation
+        session_key = f"{username}:{session_id}" if session_id and username else None
+        session = self._load_session(session_key) if session_key else None
+        if session and self._is_follow_up(question, session, where):
+            result = self._follow_up_query(question, session_key, session, where)
+            if result is not None:
+                return result
+        
         expanded_queries = self.retriever.expand_query(question)
         
-        # Combine search results from original and expanded queries
-        all_results = set()
-        for q in [question] + expanded_queries:
-            results = self.retriever.vector_search(q)
-            for doc, score in results:
-                # Use page content as a unique identifier for the document
-                all_results.add((doc.page_content, doc.metadata.get('source', 'unknown')))
+        query_embeddings = self.retriever.embed_queries([question] + expanded_queries)
+        search_results = self.retriever.search_embeddings(query_embeddings, where=where)
+        candidates = self._merge_candidates(search_results)
+        
+        reranked_results = self.retriever.rerank_results(question, candidates)
+        
+        result = self._generate_answer(question, reranked_results, expanded_queries)
+        if session_key:
+            self._save_session(session_key, [question], reranked_results, query_embeddings[0], where)
+        return result
+
+    # --- conversational follow-ups ---
 
-        # Convert back to list of Document objects for reranking
-        unique_docs = [Document(page_content=content, metadata={'source': source}) for content, source in all_results]
+    _FOLLOW_UP_PRONOUNS = {"it", "its", "that", "this", "those", "these", "they", "them", "their", "same"}
+    _FOLLOW_UP_PREFIXES = ("what about", "how about", "what else", "and ", "also ", "then ")
+    _FOLLOW_UP_STOPWORDS = {
+        "what", "which", "who", "whom", "whose", "when", "where", "why", "how",
+        "is", "are", "was", "were", "be", "been", "do", "does", "did", "can", "could", "will", "would",
+        "should", "shall", "may", "might", "must", "has", "have", "had",
+        "a", "an", "the", "of", "to", "in", "on", "for", "at", "by", "with", "from", "about", "as",
+        "and", "or", "but", "if", "so", "than", "i", "me", "my", "we", "us", "our", "you", "your",
+        "much", "many", "more", "there", "any", "some", "not", "no", "else", "again", "please",
+    }
+    _FOLLOW_UP_MAX_CONTENT_WORDS = 2
+
+    def _load_session(self, session_key: str) -> Optional[Dict[str, Any]]:
+        return self.retriever.cache.get(f"session:{session_key}")
+
+    def _save_session(self, session_key: str, questions: List[str], reranked_results: List[Tuple[Document, float]],
+                      query_embedding: np.ndarray, where: Optional[Dict[str, Any]]):
+        """Remember this turn's reranked chunk ids and query embedding for the next turn"""
+        self.retriever.cache.set(f"session:{session_key}", {
+            "questions": questions[-self.config.follow_up_history_turns:],
+            "chunk_ids": [doc.metadata["chunk_id"] for doc, _ in reranked_results],
+            "embedding": _encode_vector(query_embedding),
+            "where": where,
+        }, self.config.session_ttl)
+
+    def _is_follow_up(self, question: str, session: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+        """Cheap check for questions that lean on the previous turn for context"""
+        if session.get("where") != where or not session.get("chunk_ids"):
+            return False
+        lowered = question.lower().strip()
+        if lowered.startswith(self._FOLLOW_UP_PREFIXES):
+            return True
+        # Otherwise it needs a referring pronoun and almost no subject matter of its own,
+        # e.g. "When is it due?" but not "Which courses require a lab that is supervised?"
+        words = re.findall(r"[a-z']+", lowered)
+        content_words = [word for word in words
+                         if word not in self._FOLLOW_UP_STOPWORDS and word not in self._FOLLOW_UP_PRONOUNS]
+        return (any(word in self._FOLLOW_UP_PRONOUNS for word in words)
+                and len(content_words) <= self._FOLLOW_UP_MAX_CONTENT_WORDS)
+
+    def _follow_up_query(self, question: str, session_key: str, session: Dict[str, Any],
+                         where: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Answer a follow-up by reranking the last turn's chunks plus a small fresh search.
+
+        The search vector blends the new question's embedding with the previous
+        turn's, so no expansion call or full-width search is needed. The recent
+        questions joined with this one are used for reranking only; the LLM
+        gets the question itself with the earlier questions as history; neither
+        is returned to the caller. Returns None when the fresh hits score below ``follow_up_min_score``,
+        meaning the question has moved on and needs the full pipeline.
+        """
+        questions = session["questions"] + [question]
+        rewritten = " ".join(questions[-(self.config.follow_up_history_turns + 1):])
+        logger.info(f"Follow-up in session {session_key}, rewritten as: {rewritten}")
+        
+        question_embedding = self.retriever.embed_queries([question])[0]
+        previous_embedding = _decode_vector(session["embedding"])
+        blended = question_embedding / (np.linalg.norm(question_embedding) or 1.0) \
+            + previous_embedding / (np.linalg.norm(previous_embedding) or 1.0)
+        blended = blended / (np.linalg.norm(blended) or 1.0)
         
-        reranked_results = self.retriever.rerank_results(question, [(doc, 0.0) for doc in unique_docs]) # Pass dummy scores
+        fresh_results = self.retriever.search_embeddings(blended[None, :], self.config.follow_up_fresh_k, where)
+        best_score = max((score for _, score in fresh_results[0]), default=0.0)
+        if best_score < self.config.follow_up_min_score:
+            logger.info(f"Follow-up in session {session_key} scored {best_score:.3f}; running the full pipeline")
+            return None
+        cached_results = self.retriever.get_chunks(session["chunk_ids"])
+        candidates = self._merge_candidates([cached_results] + fresh_results)
         
+        reranked_results = self.retriever.rerank_results(rewritten, candidates)
+        
+        history = session["questions"][-self.config.follow_up_history_turns:]
+        result = self._generate_answer(question, reranked_results, [], history=history)
+        self._save_session(session_key, questions, reranked_results, blended, where)
+        return result
+
+    def query_batch(self, questions: List[str], scope: Optional[Dict[str, Any]] = None,
+                    max_concurrency: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Answer many questions, sharing encoder and reranker passes across the batch.
+
+        Expansions run concurrently, all questions and expansions are embedded
+        and searched in one pass, and every (question, chunk) pair is reranked
+        in shared batches. Answer generation then runs concurrently under
+        ``max_concurrency`` and results are yielded as each one completes,
+        tagged with the question's ``index`` in the input list.
+        """
+        if not self.is_indexed:
+            raise ValueError("No documents have been indexed yet.")
+        
+        logger.info(f"Processing batch of {len(questions)} queries")
+        max_concurrency = max_concurrency or self.config.batch_llm_concurrency
+        where = self._scope_filter(scope)
+        
+        # Shut down explicitly: if the client disconnects the generator is closed at a
+        # yield, and queued answer generations must be cancelled rather than awaited
+        executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        try:
+            expansions = list(executor.map(self.retriever.expand_query, questions))
+            
+            all_queries, owners = [], []
+            for i, (question, expanded_queries) in enumerate(zip(questions, expansions)):
+                for q in [question] + expanded_queries:
+                    all_queries.append(q)
+                    owners.append(i)
+            
+            grouped_results = [[] for _ in questions]
+            for owner, results in zip(owners, self.retriever.vector_search_batch(all_queries, where=where)):
+                grouped_results[owner].append(results)
+            
+            candidates = [self._merge_candidates(results) for results in grouped_results]
+            reranked = self.retriever.rerank_results_batch(questions, candidates)
+            
+            futures = {
+                executor.submit(self._generate_answer, question, reranked_results, expanded_queries): i
+                for i, (question, reranked_results, expanded_queries) in enumerate(zip(questions, reranked, expansions))
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"Batch query {i} failed: {e}")
+                    result = {"question": questions[i], "error": str(e)}
+                yield {"index": i, **result}
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _scope_filter(self, scope: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Build the ``where`` filter for a scope, also matching chunks through deduplicated copies"""
+        where = build_scope_filter(**(scope or {}))
+        if where is None or self.deduplicator is None:
+            return where
+        canonical_ids = self.deduplicator.matching_canonical_ids(scope)
+        if canonical_ids:
+            where = {"$or": [where, {"chunk_id": {"$in": canonical_ids}}]}
+        return where
+
+    @staticmethod
+    def _merge_candidates(search_results: List[List[Tuple[Document, float]]]) -> List[Tuple[Document, float]]:
+        """Combine results of the original and expanded queries, keeping full chunk metadata"""
+        unique_docs: Dict[str, Tuple[Document, float]] = {}
+        for results in search_results:
+            for doc, score in results:
+                chunk_id = doc.metadata["chunk_id"]
+                if chunk_id not in unique_docs or score > unique_docs[chunk_id][1]:
+                    unique_docs[chunk_id] = (doc, score)
+        return list(unique_docs.values())
+
+    def _generate_answer(self, question: str, reranked_results: List[Tuple[Document, float]],
+                         expanded_queries: List[str], history: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Compress the reranked context and ask the LLM for the final answer.
+
+        ``history`` holds the session's earlier questions, given to the LLM so
+        it can resolve references like "it" in a follow-up.
+        """
         contexts = [doc.page_content for doc, _ in reranked_results]
         sources = [doc.metadata.get('source', 'unknown') for doc, _ in reranked_results]
+        citations = [
+            {
+                "chunk_id": doc.metadata.get("chunk_id"),
+                "source": doc.metadata.get("source", "unknown"),
+                "page": doc.metadata.get("page"),
+                "section_title": doc.metadata.get("section_title"),
+                "score": score,
+                "references": self.deduplicator.references(doc.metadata.get("chunk_id")) if self.deduplicator else [],
+            }
+            for doc, score in reranked_results
+        ]
+        # Duplicated chunks are stored once, so collect every file they appeared in
+        for citation in citations:
+            sources.extend(reference["source"] for reference in citation["references"])
         
-        compressed_context = self.context_optimizer.compress_context(question, contexts)
+        # Compression ranks sentences by relevance, so give it the question with its history
+        compressed_context = self.context_optimizer.compress_context(" ".join((history or []) + [question]), contexts)
+        conversation = "".join(f"- {previous}\n" for previous in history or [])
+        conversation = f"Conversation so far:\n{conversation}\n" if conversation else ""
         
         try:
             response = self.openai_client.chat.completions.create(
                 model="gpt-4-turbo",
                 messages=[
                     {"role": "system", "content": "You are a helpful assistant. Answer the question based ONLY on the provided context. Cite the source document for each piece of information used."},
-                    {"role": "user", "content": f"Context:\n{compressed_context}\n\nQuestion: {question}\n\nAnswer:"}
+                    {"role": "user", "content": f"Context:\n{compressed_context}\n\n{conversation}Question: {question}\n\nAnswer:"}
                 ],
                 max_tokens=500
             )
@@ -686,6 +1550,7 @@ class RAGPipeline:
             "answer": answer,
             "context": compressed_context,
             "sources": list(set(sources)),
+            "citations": citations,
             "expanded_queries": expanded_queries,
         }
 
@@ -702,9 +1567,19 @@ config = RAGConfig(
     top_k_retrieval=15,
     top_k_rerank=5,
     chroma_db_path="./my_rag_db",
+    vector_store_backend=os.getenv("VECTOR_STORE_BACKEND", "chroma"),
+    local_index_path="./my_rag_db/local_index",
+    dedupe_index_path="./my_rag_db/dedupe",
+    num_shards=int(os.getenv("VECTOR_STORE_SHARDS", "1")),
+    # Without a real Mistral key, image-only pages keep their (empty) text layer instead of failing OCR calls
+    ocr_backend=os.getenv("OCR_BACKEND", "mistral" if MISTRAL_API_KEY != "your_mistral_api_key" else "none"),
+    ocr_cache_path="./my_rag_db/ocr_cache",
 )
 rag_pipeline = RAGPipeline(config, MISTRAL_API_KEY, OPENAI_API_KEY)
 
+# Authenticated users, cached briefly so each request doesn't hit MongoDB
+user_cache = LocalCache(maxsize=10000, ttl=USER_CACHE_TTL_SECONDS)
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Advanced RAG Pipeline API",
@@ -713,24 +1588,48 @@ app = FastAPI(
 )
 
 # Pydantic Models for API requests and responses
+class QueryScope(BaseModel):
+    sources: Optional[List[str]] = Field(None, description="Only retrieve from these source files.")
+    section: Optional[str] = Field(None, description="Not supported yet: documents are indexed without section titles.")
+    page_from: Optional[int] = Field(None, description="First page to include.")
+    page_to: Optional[int] = Field(None, description="Last page to include.")
+    ingested_after: Optional[datetime] = Field(None, description="Only documents ingested at or after this time (UTC if no offset is given).")
+    ingested_before: Optional[datetime] = Field(None, description="Only documents ingested at or before this time (UTC if no offset is given).")
+    tenant: Optional[str] = Field(None, description="Only documents ingested for this tenant/collection.")
+
 class QueryRequest(BaseModel):
     question: str = Field(..., example="What are the main findings discussed in chapter 3?")
     use_iterative_retrieval: bool = Field(False, description="Use iterative retrieval for complex queries.")
+    scope: Optional[QueryScope] = Field(None, description="Restrict retrieval to a subset of the indexed chunks.")
+    session_id: Optional[str] = Field(None, description="Conversation id, scoped to the signed-in user; follow-up questions reuse the previous turn's retrieval.")
 
 class QueryResponse(BaseModel):
     question: str
     answer: str
     context: str
     sources: List[str]
+    citations: List[Dict[str, Any]] = []
     expanded_queries: List[str]
 
+class BatchQueryRequest(BaseModel):
+    questions: List[str] = Field(..., example=["What is the late submission policy?", "Who approves extensions?"])
+    scope: Optional[QueryScope] = Field(None, description="Restrict retrieval for every question in the batch.")
+    max_concurrency: Optional[int] = Field(None, ge=1, le=64, description="Maximum concurrent LLM calls.")
+
 class StatusResponse(BaseModel):
     is_indexed: bool
     collection_stats: Dict[str, Any]
 
 @app.on_event("startup")  # This is the correct syntax for older FastAPI versions
 async def startup_event():
-    """On startup, process any new documents in the Knowledgebase folder."""
+    """On startup, ensure database indexes and process any new documents in the Knowledgebase folder."""
+    try:
+        await user_collection.create_index("username", unique=True)
+    except Exception as e:
+        logger.error(f"Failed to ensure unique username index: {e}")
+    if RESTORE_SNAPSHOT_PATH and not rag_pipeline.is_indexed:
+        logger.info(f"Restoring index snapshot from {RESTORE_SNAPSHOT_PATH}...")
+        await asyncio.to_thread(rag_pipeline.restore_snapshot, RESTORE_SNAPSHOT_PATH)
     logger.info("Application startup: Checking for new documents in Knowledgebase...")
     knowledge_base_files = [str(f) for f in KNOWLEDGEBASE_DIR.glob("*.pdf")]
     if knowledge_base_files:
@@ -743,9 +1642,13 @@ async def signup(user: UserCreate):
     existing = await user_collection.find_one({"username": user.username})
     if existing:
         raise HTTPException(status_code=400, detail="Username already registered")
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     user_doc = {"username": user.username, "hashed_password": hashed_password, "role": user.role}
-    await user_collection.insert_one(user_doc)
+    try:
+        await user_collection.insert_one(user_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Username already registered")
+    invalidate_user(user.username)
     return {"message": "User created successfully"}
 
 @app.post("/login", response_model=Token, summary="User login")
@@ -757,10 +1660,12 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/process-documents/", summary="Upload and Process Documents")
-async def process_documents_endpoint(files: List[UploadFile] = File(...)):
+async def process_documents_endpoint(files: List[UploadFile] = File(...), tenant: str = Form("default")):
     """
     Upload one or more PDF documents. The system will also scan the 'Knowledgebase'
-    folder for any new documents and process them all.
+    folder for any new documents and process them all. Uploaded chunks are tagged
+    with ``tenant`` so queries can be scoped to it; Knowledgebase files always
+    belong to the "default" tenant.
     """
     temp_dir = Path("temp_uploads")
     temp_dir.mkdir(exist_ok=True)
@@ -772,15 +1677,19 @@ async def process_documents_endpoint(files: List[UploadFile] = File(...)):
             shutil.copyfileobj(file.file, buffer)
         uploaded_file_paths.append(str(file_path))
 
-    # Also check the knowledgebase directory for new files
+    # Also check the knowledgebase directory for new files; those belong to the default tenant, not the uploader's
     knowledge_base_files = [str(f) for f in KNOWLEDGEBASE_DIR.glob("*.pdf")]
-    all_files_to_process = list(set(uploaded_file_paths + knowledge_base_files))
     
     try:
-        processed_count = await asyncio.to_thread(rag_pipeline.process_documents, all_files_to_process)
+        processed_count = await asyncio.to_thread(rag_pipeline.process_documents, knowledge_base_files, False, "default")
+        deduplication = dict(rag_pipeline.last_dedupe_report)
+        processed_count += await asyncio.to_thread(rag_pipeline.process_documents, uploaded_file_paths, False, tenant)
+        for key, value in rag_pipeline.last_dedupe_report.items():
+            deduplication[key] = deduplication.get(key, 0) + value
         return {
             "message": f"Successfully processed {processed_count} new documents.",
-            "total_chunks_in_db": rag_pipeline.retriever.get_collection_stats().get("total_chunks")
+            "total_chunks_in_db": rag_pipeline.retriever.get_collection_stats().get("total_chunks"),
+            "deduplication": deduplication
         }
     except Exception as e:
         logger.error(f"Error during document processing: {e}", exc_info=True)
@@ -789,26 +1698,62 @@ async def process_documents_endpoint(files: List[UploadFile] = File(...)):
         # Clean up temporary uploaded files
         shutil.rmtree(temp_dir, ignore_errors=True)
 
+def scope_filter_args(scope: Optional[QueryScope]) -> Optional[Dict[str, Any]]:
+    """Validate a request scope and return it as ``build_scope_filter`` keyword arguments"""
+    if scope is None:
+        return None
+    if scope.section is not None:
+        raise HTTPException(status_code=400, detail="Section scoping is not supported yet: documents are indexed without section titles.")
+    return scope.dict(exclude_none=True)
+
 @app.post("/query/", response_model=QueryResponse, summary="Query the RAG System")
-async def query_endpoint(request: QueryRequest):
+async def query_endpoint(request: QueryRequest, current_user: Optional[UserInDB] = Depends(get_optional_user)):
     """
     Ask a question to the RAG system. The system will retrieve relevant context
-    from the indexed documents and generate a comprehensive answer.
+    from the indexed documents and generate a comprehensive answer. Anonymous
+    queries are allowed, but a ``session_id`` requires a signed-in user.
     """
     if not rag_pipeline.is_indexed:
         raise HTTPException(status_code=400, detail="No documents have been processed. Please upload documents first.")
+    if request.session_id and current_user is None:
+        raise HTTPException(status_code=401, detail="Sign in to use conversation sessions.",
+                            headers={"WWW-Authenticate": "Bearer"})
+    scope = scope_filter_args(request.scope)
     
     try:
         result = await asyncio.to_thread(
             rag_pipeline.query,
             request.question,
-            request.use_iterative_retrieval
+            request.use_iterative_retrieval,
+            scope,
+            request.session_id,
+            current_user.username if current_user else None
         )
         return result
     except Exception as e:
         logger.error(f"Error during query: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"An error occurred during the query: {e}")
 
+@app.post("/query/batch", summary="Batch Query the RAG System")
+async def query_batch_endpoint(request: BatchQueryRequest):
+    """
+    Answer many questions in one request. Retrieval and reranking are shared
+    across the batch and answers are streamed back as newline-delimited JSON,
+    one object per question in completion order, each tagged with its index.
+    """
+    if not rag_pipeline.is_indexed:
+        raise HTTPException(status_code=400, detail="No documents have been processed. Please upload documents first.")
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="At least one question is required.")
+    
+    results = rag_pipeline.query_batch(
+        request.questions,
+        scope_filter_args(request.scope),
+        request.max_concurrency
+    )
+    # Starlette iterates sync generators in its threadpool, so the event loop stays free
+    return StreamingResponse((json.dumps(result) + "\n" for result in results), media_type="application/x-ndjson")
+
 @app.get("/status/", response_model=StatusResponse, summary="Get System Status")
 async def get_status():
     """
@@ -816,6 +1761,8 @@ async def get_status():
     been indexed and statistics about the document collection.
     """
     stats = await asyncio.to_thread(rag_pipeline.retriever.get_collection_stats)
+    if rag_pipeline.deduplicator is not None:
+        stats["deduplication"] = rag_pipeline.deduplicator.get_stats()
     return {
         "is_indexed": rag_pipeline.is_indexed,
         "collection_stats": stats
@@ -833,6 +1780,10 @@ async def reset_index():
         if PROCESSED_FILES_LOG.exists():
             os.remove(PROCESSED_FILES_LOG)
         rag_pipeline.processed_hashes.clear()
+        # Cached follow-up candidates point at chunks that no longer exist
+        await asyncio.to_thread(rag_pipeline.retriever.cache.invalidate, "session:")
+        if rag_pipeline.deduplicator is not None:
+            rag_pipeline.deduplicator.reset()
         rag_pipeline.is_indexed = False
         return {"message": "Successfully reset the document index and cleared the processed files log."}
     except Exception as e:
@@ -844,22 +1795,26 @@ async def reset_index():
 @app.post("/chat-history/", summary="Store a chat message for the user")
 async def store_chat_message(message: Dict[str, str], current_user: UserInDB = Depends(get_current_active_user)):
     """Store a chat message for the current user in Redis."""
-    if not hasattr(rag_pipeline.retriever, 'redis_client') or rag_pipeline.retriever.redis_client is None:
-        raise HTTPException(status_code=500, detail="Redis is not available.")
     key = f"chat_history:{current_user.username}"
     # message: {"role": "user"|"assistant", "text": "..."}
-    rag_pipeline.retriever.redis_client.rpush(key, json.dumps(message))
-    # Optionally, limit history length
-    rag_pipeline.retriever.redis_client.ltrim(key, -100, -1)
+    try:
+        # Append and trim (limit history length) in one round trip
+        async with rag_pipeline.retriever.cache.async_redis.pipeline(transaction=True) as pipe:
+            await pipe.rpush(key, json.dumps(message)).ltrim(key, -100, -1).execute()
+    except redis.RedisError as e:
+        logger.error(f"Failed to store chat message: {e}")
+        raise HTTPException(status_code=500, detail="Redis is not available.")
     return {"message": "Message stored."}
 
 @app.get("/chat-history/", summary="Get chat history for the user")
 async def get_chat_history(current_user: UserInDB = Depends(get_current_active_user)):
     """Retrieve chat history for the current user from Redis."""
-    if not hasattr(rag_pipeline.retriever, 'redis_client') or rag_pipeline.retriever.redis_client is None:
-        raise HTTPException(status_code=500, detail="Redis is not available.")
     key = f"chat_history:{current_user.username}"
-    history = rag_pipeline.retriever.redis_client.lrange(key, 0, -1)
+    try:
+        history = await rag_pipeline.retriever.cache.async_redis.lrange(key, 0, -1)
+    except redis.RedisError as e:
+        logger.error(f"Failed to load chat history: {e}")
+        raise HTTPException(status_code=500, detail="Redis is not available.")
     return [json.loads(msg) for msg in history]
 
 @app.post("/admin/delete-document", summary="Delete a document from the Knowledgebase")
@@ -874,6 +1829,58 @@ async def delete_document(filename: str = Body(...), current_user: UserInDB = De
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete: {e}")
 
+@app.post("/admin/snapshot/export", summary="Export an index snapshot")
+async def export_snapshot(current_user: UserInDB = Depends(get_current_admin_user)):
+    """Write a consistent snapshot bundle of the index to the snapshots folder (admin only)."""
+    filename = f"snapshot-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.tar"
+    try:
+        manifest = await asyncio.to_thread(rag_pipeline.export_snapshot, str(SNAPSHOT_DIR / filename))
+    except Exception as e:
+        logger.error(f"Error during snapshot export: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to export snapshot: {e}")
+    return {"filename": filename, "manifest": manifest}
+
+@app.post("/admin/snapshot/import", summary="Restore the index from a snapshot")
+async def import_snapshot(filename: str = Body(..., embed=True), current_user: UserInDB = Depends(get_current_admin_user)):
+    """Replace the index with a snapshot bundle from the snapshots folder (admin only)."""
+    snapshot_path = SNAPSHOT_DIR / Path(filename).name
+    if not snapshot_path.is_file():
+        raise HTTPException(status_code=404, detail="Snapshot not found.")
+    try:
+        manifest = await asyncio.to_thread(rag_pipeline.restore_snapshot, str(snapshot_path))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error during snapshot import: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to import snapshot: {e}")
+    return {"message": f"Restored {manifest['chunk_count']} chunks from {filename}", "manifest": manifest}
+
+@app.post("/admin/shards/{shard}/rebuild", summary="Rebuild one vector store shard")
+async def rebuild_shard(shard: int, current_user: UserInDB = Depends(get_current_admin_user)):
+    """Rebuild a single shard from its own contents without touching the others (admin only)."""
+    vector_store = rag_pipeline.retriever.vector_store
+    if not isinstance(vector_store, ShardedVectorStore):
+        raise HTTPException(status_code=400, detail="The vector store is not sharded.")
+    if not 0 <= shard < len(vector_store.shards):
+        raise HTTPException(status_code=404, detail="Shard not found.")
+    try:
+        await asyncio.to_thread(rag_pipeline.rebuild_shard, shard)
+    except Exception as e:
+        logger.error(f"Error during shard rebuild: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild shard: {e}")
+    return {"message": f"Rebuilt shard {shard}", "total_chunks": vector_store.shards[shard].count()}
+
+@app.post("/admin/set-role", summary="Change a user's role")
+async def set_user_role(username: str = Body(...), role: str = Body(...), current_user: UserInDB = Depends(get_current_admin_user)):
+    """Change a user's role (admin only). Takes effect immediately on this instance."""
+    if role not in ("admin", "user"):
+        raise HTTPException(status_code=400, detail="Role must be 'admin' or 'user'.")
+    result = await user_collection.update_one({"username": username}, {"$set": {"role": role}})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="User not found.")
+    invalidate_user(username)
+    return {"message": f"Set role of {username} to {role}"}
+
 # Health check endpoint
 @app.get("/health", summary="Health Check")
 async def health_check():
@@ -0,0 +1,177 @@
+import os
+import io
+import base64
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class OCRBackend:
+    """Interface for services that turn a rendered page image into text"""
+
+    name = "base"
+
+    def ocr_page(self, image: bytes) -> str:
+        raise NotImplementedError
+
+class MistralOCRBackend(OCRBackend):
+    """OCR through the Mistral OCR API, one PNG page image per request"""
+
+    name = "mistral"
+
+    def __init__(self, client, model: str):
+        self.client = client
+        self.model = model
+
+    def ocr_page(self, image: bytes) -> str:
+        response = self.client.ocr.process(
+            model=self.model,
+            document={
+                "type": "image_url",
+                "image_url": f"data:image/png;base64,{base64.b64encode(image).decode('ascii')}"
+            }
+        )
+        return "\n".join(page.markdown for page in response.pages)
+
+class LocalOCRBackend(OCRBackend):
+    """Offline stand-in backend for tests: returns canned text per page-image hash and records calls"""
+
+    name = "local"
+
+    def __init__(self, responses: Optional[Dict[str, str]] = None):
+        self.responses = responses or {}
+        self.calls: List[str] = []
+        self._lock = threading.Lock()
+
+    def ocr_page(self, image: bytes) -> str:
+        image_hash = hashlib.sha256(image).hexdigest()
+        with self._lock:
+            self.calls.append(image_hash)
+        return self.responses.get(image_hash, "")
+
+class RateLimiter:
+    """Spaces calls at least ``1 / rate`` seconds apart across threads"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+class OCRCache:
+    """On-disk cache of OCR output keyed by the SHA-256 of the rendered page image"""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _file(self, image_hash: str) -> Path:
+        return self.path / image_hash[:2] / f"{image_hash}.txt"
+
+    def get(self, image_hash: str) -> Optional[str]:
+        file = self._file(image_hash)
+        if not file.exists():
+            return None
+        return file.read_text(encoding="utf-8")
+
+    def set(self, image_hash: str, text: str):
+        file = self._file(image_hash)
+        file.parent.mkdir(exist_ok=True)
+        tmp_file = file.with_suffix(".tmp")
+        tmp_file.write_text(text, encoding="utf-8")
+        os.replace(tmp_file, file)
+
+class PageOCRRouter:
+    """Extracts text page by page, sending only image-only pages to an OCR backend.
+
+    Pages with a usable text layer keep their extracted text. Image-only pages
+    are rendered one at a time, hashed and looked up in the cache straight
+    away; only misses are submitted to the backend, and at most
+    ``2 * max_concurrency`` rendered images are held in memory at once.
+    Identical page images within a document are OCR'd once.
+    """
+
+    def __init__(self, backend: Optional[OCRBackend], cache: OCRCache, min_text_chars: int = 20,
+                 resolution: int = 150, max_concurrency: int = 4, requests_per_second: float = 0.0):
+        self.backend = backend
+        self.cache = cache
+        self.min_text_chars = min_text_chars
+        self.resolution = resolution
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = RateLimiter(requests_per_second)
+
+    def needs_ocr(self, page_text: str) -> bool:
+        return self.backend is not None and len(page_text.strip()) < self.min_text_chars
+
+    def extract_pages(self, pages) -> List[str]:
+        """Return one text per page, OCR'd where the page has no usable text layer"""
+        page_texts: List[str] = []
+        waiting: Dict[str, List[int]] = {}
+        futures = {}
+        cache_hits = 0
+        slots = threading.BoundedSemaphore(2 * self.max_concurrency)
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for i, page in enumerate(pages):
+                page_text = page.extract_text() or ""
+                page_texts.append(page_text)
+                if not self.needs_ocr(page_text):
+                    continue
+
+                image = self._render_page(page)
+                image_hash = hashlib.sha256(image).hexdigest()
+                if image_hash in waiting:
+                    waiting[image_hash].append(i)
+                    continue
+                cached = self.cache.get(image_hash)
+                if cached is not None:
+                    cache_hits += 1
+                    if cached.strip():
+                        page_texts[i] = cached
+                    continue
+
+                waiting[image_hash] = [i]
+                # Blocks rendering until an in-flight image has been OCR'd and released
+                slots.acquire()
+                futures[executor.submit(self._ocr_page, image, slots)] = image_hash
+
+        for future, image_hash in futures.items():
+            try:
+                text = future.result()
+                self.cache.set(image_hash, text)
+            except Exception as e:
+                logger.error(f"OCR failed for page image {image_hash[:12]}: {e}")
+                continue
+            if text.strip():
+                for i in waiting[image_hash]:
+                    page_texts[i] = text
+
+        ocr_pages = cache_hits + sum(len(indexes) for indexes in waiting.values())
+        if ocr_pages:
+            logger.info(f"OCR: {ocr_pages} image-only pages, {cache_hits} from cache, "
+                        f"{len(futures)} sent to {self.backend.name}")
+        return page_texts
+
+    def _render_page(self, page) -> bytes:
+        buffer = io.BytesIO()
+        page.to_image(resolution=self.resolution).original.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    def _ocr_page(self, image: bytes, slots: threading.BoundedSemaphore) -> str:
+        try:
+            self.rate_limiter.acquire()
+            return self.backend.ocr_page(image)
+        finally:
+            slots.release()
@@ -0,0 +1,48 @@
+from dataclasses import dataclass
+
+@dataclass
+class RAGConfig:
+    chunk_size: int = 500
+    chunk_overlap: int = 50
+    embedding_model: str = "all-MiniLM-L6-v2"
+    reranker_model: str = "BAAI/bge-reranker-base"
+    vector_dim: int = 384
+    top_k_retrieval: int = 20
+    top_k_rerank: int = 5
+    redis_host: str = "localhost"
+    redis_port: int = 6379
+    redis_max_connections: int = 20
+    redis_retry_interval: float = 30.0
+    local_cache_size: int = 10000
+    local_cache_ttl: int = 600
+    query_cache_ttl: int = 3600
+    chroma_db_path: str = "./chroma_db"
+    chroma_collection_name: str = "document_chunks"
+    vector_store_backend: str = "chroma"  # 'chroma' or 'local'
+    local_index_path: str = "./local_index"
+    local_index_dtype: str = "float16"  # 'float16' or 'int8'
+    ivf_nlist: int = 64
+    ivf_nprobe: int = 8
+    ivf_min_train_size: int = 4096
+    num_shards: int = 1
+    shard_key: str = "file_hash"  # metadata field used to route chunks, e.g. 'file_hash' or 'tenant'
+    max_concurrent_queries: int = 16  # concurrent requests the shard fan-out pool is sized for
+    ocr_backend: str = "mistral"  # 'mistral', 'local' or 'none'
+    ocr_model: str = "mistral-ocr-latest"
+    ocr_min_text_chars: int = 20
+    ocr_resolution: int = 150
+    ocr_max_concurrency: int = 4
+    ocr_requests_per_second: float = 4.0
+    ocr_cache_path: str = "./ocr_cache"
+    session_ttl: int = 900
+    follow_up_fresh_k: int = 5
+    follow_up_history_turns: int = 2
+    follow_up_min_score: float = 0.5  # below this best fresh-hit score a follow-up takes the full pipeline
+    rerank_batch_size: int = 64
+    dedupe_enabled: bool = True
+    dedupe_index_path: str = "./dedupe_index"
+    dedupe_threshold: float = 0.85
+    minhash_num_perm: int = 128
+    minhash_bands: int = 16
+    shingle_size: int = 5
+    batch_llm_concurrency: int = 8
@@ -0,0 +1,80 @@
+import hashlib
+
+from ocr import LocalOCRBackend, OCRCache, PageOCRRouter
+
+
+class FakeImage:
+    def __init__(self, content: bytes):
+        self.content = content
+
+    def save(self, buffer, format=None):
+        buffer.write(self.content)
+
+
+class FakeRendering:
+    def __init__(self, content: bytes):
+        self.original = FakeImage(content)
+
+
+class FakePage:
+    """Mimics the parts of a pdfplumber page the router uses"""
+
+    def __init__(self, text: str = "", image: bytes = b""):
+        self.text = text
+        self.image = image
+        self.renders = 0
+
+    def extract_text(self):
+        return self.text
+
+    def to_image(self, resolution=None):
+        self.renders += 1
+        return FakeRendering(self.image)
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_router(tmp_path, backend):
+    return PageOCRRouter(backend, OCRCache(str(tmp_path / "ocr_cache")), min_text_chars=20, max_concurrency=2)
+
+
+def test_only_image_only_pages_are_ocrd(tmp_path):
+    backend = LocalOCRBackend({sha256(b"scan-1"): "Scanned module handbook"})
+    text_page = FakePage(text="This page has a perfectly good text layer.")
+    scanned_page = FakePage(image=b"scan-1")
+
+    texts = make_router(tmp_path, backend).extract_pages([text_page, scanned_page])
+
+    assert texts == ["This page has a perfectly good text layer.", "Scanned module handbook"]
+    assert text_page.renders == 0
+    assert backend.calls == [sha256(b"scan-1")]
+
+
+def test_repeated_page_images_are_ocrd_once(tmp_path):
+    backend = LocalOCRBackend({sha256(b"logo"): "Course handbook", sha256(b"scan"): "Fees"})
+    pages = [FakePage(image=b"logo"), FakePage(image=b"scan"), FakePage(image=b"logo")]
+
+    texts = make_router(tmp_path, backend).extract_pages(pages)
+
+    assert texts == ["Course handbook", "Fees", "Course handbook"]
+    assert sorted(backend.calls) == sorted([sha256(b"logo"), sha256(b"scan")])
+
+
+def test_reingest_is_served_from_cache(tmp_path):
+    backend = LocalOCRBackend({sha256(b"scan"): "Exam regulations"})
+    make_router(tmp_path, backend).extract_pages([FakePage(image=b"scan")])
+    assert len(backend.calls) == 1
+
+    texts = make_router(tmp_path, backend).extract_pages([FakePage(image=b"scan")])
+
+    assert texts == ["Exam regulations"]
+    assert len(backend.calls) == 1
+
+
+def test_no_backend_keeps_text_layer(tmp_path):
+    page = FakePage(text="short", image=b"scan")
+
+    assert make_router(tmp_path, None).extract_pages([page]) == ["short"]
+    assert page.renders == 0
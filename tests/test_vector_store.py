@@ -0,0 +1,221 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from rag_config import RAGConfig
+from vector_store import LocalVectorStore, ReadWriteLock, ShardedVectorStore
+
+
+def make_config(tmp_path, **overrides):
+    return RAGConfig(local_index_path=str(tmp_path / "index"), vector_store_backend="local", **overrides)
+
+
+def unit_vectors(count, dim=8, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def fill(store, count=40, offset=0):
+    ids = [f"c{offset + i}" for i in range(count)]
+    metadatas = [{"source": f"f{i % 4}.pdf", "page": i, "tenant": "A" if i % 2 else "B"} for i in range(count)]
+    vectors = unit_vectors(count, seed=offset)
+    store.add(ids, vectors, [f"chunk {offset + i}\nwith a newline" for i in range(count)], metadatas)
+    return ids, vectors
+
+
+def hit_ids(hits):
+    return [hit[0] for hit in hits]
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_add_and_query_returns_nearest_first(tmp_path, dtype):
+    store = LocalVectorStore(make_config(tmp_path, local_index_dtype=dtype))
+    ids, vectors = fill(store)
+
+    hits = store.query(vectors[:3], k=5)
+
+    assert [query_hits[0][0] for query_hits in hits] == ids[:3]
+    assert all(query_hits[0][3] < 0.01 for query_hits in hits)
+    assert hits[0][0][1] == "chunk 0\nwith a newline"
+    assert hits[0][0][2] == {"source": "f0.pdf", "page": 0, "tenant": "B"}
+
+
+def test_add_skips_known_ids(tmp_path):
+    store = LocalVectorStore(make_config(tmp_path))
+    ids, vectors = fill(store)
+
+    assert store.add(ids[:5], vectors[:5], ["x"] * 5, [{}] * 5) == 0
+    assert store.count() == 40
+
+
+def test_filters(tmp_path):
+    store = LocalVectorStore(make_config(tmp_path))
+    _, vectors = fill(store)
+
+    def matching(where):
+        return {hit[2]["page"] for hit in store.query(vectors[:1], k=100, where=where)[0]}
+
+    assert matching({"source": "f1.pdf"}) == {1, 5, 9, 13, 17, 21, 25, 29, 33, 37}
+    assert matching({"source": {"$in": ["f1.pdf", "f2.pdf"]}, "tenant": "A"}) == {1, 5, 9, 13, 17, 21, 25, 29, 33, 37}
+    assert matching({"$and": [{"page": {"$gte": 10}}, {"page": {"$lt": 13}}]}) == {10, 11, 12}
+    assert matching({"$or": [{"page": 3}, {"page": {"$gt": 37}}]}) == {3, 38, 39}
+    assert len(matching({"source": {"$nin": ["f0.pdf"]}})) == 30
+    assert len(matching({"tenant": {"$ne": "A"}})) == 20
+    assert matching({"chunk_id": {"$in": ["c7", "missing"]}}) == {7}
+    assert matching({"source": "nowhere.pdf"}) == set()
+
+
+def test_reopen_and_late_metadata_field(tmp_path):
+    config = make_config(tmp_path)
+    store = LocalVectorStore(config)
+    ids, vectors = fill(store)
+    store.add(["late"], unit_vectors(1, seed=99), ["late chunk"], [{"section_title": "Fees"}])
+
+    reopened = LocalVectorStore(config)
+
+    assert reopened.count() == 41
+    assert hit_ids(reopened.query(vectors[:1], k=10, where={"section_title": "Fees"})[0]) == ["late"]
+    assert reopened.get(["c3", "late", "missing"])[1] == ("late", "late chunk", {"section_title": "Fees"})
+    exported_ids, embeddings, documents, metadatas = reopened.export_all()
+    assert exported_ids == ids + ["late"]
+    assert embeddings.shape == (41, 8)
+    assert documents[0] == "chunk 0\nwith a newline"
+
+
+def test_interrupted_append_is_truncated_on_open(tmp_path):
+    config = make_config(tmp_path)
+    store = LocalVectorStore(config)
+    _, vectors = fill(store)
+    # Simulate an add that wrote data files but died before updating the manifest
+    for name in ("vectors.bin", "records.jsonl", "offsets.bin", "ids.txt", "col_0.bin"):
+        with open(tmp_path / "index" / name, "ab") as f:
+            f.write(b"partial")
+
+    reopened = LocalVectorStore(config)
+    reopened.add(["new"], unit_vectors(1, seed=7), ["new chunk"], [{"source": "f9.pdf"}])
+
+    again = LocalVectorStore(config)
+    assert again.count() == 41
+    assert again.get(["new"]) == [("new", "new chunk", {"source": "f9.pdf"})]
+    assert hit_ids(again.query(vectors[:1], k=1)[0]) == ["c0"]
+
+
+def test_read_lock_is_shared_and_write_lock_exclusive():
+    lock = ReadWriteLock()
+    both_reading = threading.Barrier(2, timeout=5)
+
+    def reader():
+        with lock.read():
+            both_reading.wait()
+
+    threads = [threading.Thread(target=reader) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not both_reading.broken
+
+    order = []
+
+    def late_reader():
+        with lock.read():
+            order.append("read")
+
+    with lock.write():
+        thread = threading.Thread(target=late_reader)
+        thread.start()
+        thread.join(timeout=0.2)
+        order.append("write done")
+    thread.join()
+    assert order == ["write done", "read"]
+
+
+def test_concurrent_queries_during_adds(tmp_path):
+    store = LocalVectorStore(make_config(tmp_path))
+    ids, vectors = fill(store)
+
+    def search(_):
+        return store.query(vectors[:1], k=1)[0][0][0]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        searches = executor.map(search, range(200))
+        for batch in range(1, 5):
+            fill(store, count=10, offset=100 * batch)
+        assert set(searches) == {"c0"}
+    assert store.count() == 80
+
+
+def test_ivf_search_matches_exact_search(tmp_path):
+    store = LocalVectorStore(make_config(tmp_path, ivf_min_train_size=100, ivf_nlist=8, ivf_nprobe=8))
+    ids, vectors = fill(store, count=400)
+
+    hits = store.query(vectors[:20], k=1)
+
+    assert [query_hits[0][0] for query_hits in hits] == ids[:20]
+
+
+def test_sharded_store_routes_prunes_and_rebuilds(tmp_path):
+    store = ShardedVectorStore(make_config(tmp_path, num_shards=3, shard_key="source"), LocalVectorStore)
+    ids, vectors = fill(store)
+
+    assert sum(store.shard_counts()) == 40
+    assert store._target_shards({"source": "f1.pdf"}) == [store.shard_for("", {"source": "f1.pdf"})]
+    before = [hit_ids(hits) for hits in store.query(vectors[:5], k=5)]
+    for shard in range(3):
+        store.rebuild_shard(shard)
+
+    assert [hit_ids(hits) for hits in store.query(vectors[:5], k=5)] == before
+    assert hit_ids(store.query(vectors[2:3], k=3, where={"source": "f2.pdf"})[0])[0] == "c2"
+
+
+def test_failed_shard_rebuild_keeps_live_data(tmp_path, monkeypatch):
+    store = ShardedVectorStore(make_config(tmp_path, num_shards=2), LocalVectorStore)
+    fill(store)
+    counts = store.shard_counts()
+
+    def fail(self, *args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(LocalVectorStore, "bulk_load", fail)
+    with pytest.raises(OSError):
+        store.rebuild_shard(0)
+    monkeypatch.undo()
+
+    assert store.shard_counts() == counts
+    reopened = ShardedVectorStore(make_config(tmp_path, num_shards=2), LocalVectorStore)
+    assert reopened.shard_counts() == counts
+    store.rebuild_shard(0)
+    assert store.shard_counts() == counts
+    assert not (tmp_path / "index" / "shard0.new").exists()
+
+
+@pytest.mark.parametrize("num_shards", [1, 3])
+def test_replace_all_is_all_or_nothing(tmp_path, monkeypatch, num_shards):
+    config = make_config(tmp_path, num_shards=num_shards)
+    store = ShardedVectorStore(config, LocalVectorStore) if num_shards > 1 else LocalVectorStore(config)
+    ids, vectors = fill(store)
+    new_vectors = unit_vectors(5, seed=42)
+    new_ids = [f"n{i}" for i in range(5)]
+    new_metadatas = [{"source": f"n{i}.pdf"} for i in range(5)]
+
+    original_bulk_load = LocalVectorStore.bulk_load
+    calls = []
+
+    def fail_on_second(self, *args, **kwargs):
+        calls.append(self.path)
+        if len(calls) == min(2, num_shards):
+            raise OSError("disk full")
+        return original_bulk_load(self, *args, **kwargs)
+
+    monkeypatch.setattr(LocalVectorStore, "bulk_load", fail_on_second)
+    with pytest.raises(OSError):
+        store.replace_all(new_ids, new_vectors, ["new"] * 5, new_metadatas)
+    monkeypatch.undo()
+    assert store.count() == 40
+    assert hit_ids(store.query(vectors[:1], k=1)[0]) == ["c0"]
+
+    store.replace_all(new_ids, new_vectors, ["new"] * 5, new_metadatas)
+    assert store.count() == 5
+    assert hit_ids(store.query(new_vectors[:1], k=1)[0]) == ["n0"]
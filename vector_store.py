@@ -0,0 +1,881 @@
+import os
+import json
+import hashlib
+import logging
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import replace
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from rag_config import RAGConfig
+
+try:
+    import chromadb
+    from chromadb.config import Settings
+except ImportError:  # only the Chroma backend needs it
+    chromadb = None
+
+logger = logging.getLogger(__name__)
+
+def _clean_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep primitive metadata values as-is and stringify anything else"""
+    cleaned = {}
+    for key, value in metadata.items():
+        if value is None:
+            continue
+        if isinstance(value, (str, int, float, bool)):
+            cleaned[key] = value
+        else:
+            cleaned[key] = str(value)
+    return cleaned
+
+class ReadWriteLock:
+    """Many concurrent readers or one writer; a waiting writer blocks new readers"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writers_waiting = 0
+        self._writing = False
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+class VectorStore:
+    """Interface for the vector index backends behind AdvancedRetriever"""
+
+    name = "base"
+
+    def add(self, ids: List[str], embeddings: np.ndarray, documents: List[str],
+            metadatas: List[Dict[str, Any]]) -> int:
+        """Add chunks to the index, skipping ids that are already stored. Returns the number added."""
+        raise NotImplementedError
+
+    def query(self, query_embeddings: np.ndarray, k: int,
+              where: Optional[Dict[str, Any]] = None) -> List[List[Tuple[str, str, Dict[str, Any], float]]]:
+        """Batched top-k search returning (id, document, metadata, distance) hits per query"""
+        raise NotImplementedError
+
+    def get(self, ids: List[str]) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """Fetch stored (id, document, metadata) for the given ids, skipping unknown ones"""
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def describe(self) -> Dict[str, Any]:
+        """Backend and storage location, used to tell whether persisted ingest state belongs to this store"""
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+    def export_all(self) -> Tuple[List[str], np.ndarray, List[str], List[Dict[str, Any]]]:
+        """Return every stored (ids, embeddings, documents, metadatas)"""
+        raise NotImplementedError
+
+    def create_staging(self) -> "VectorStore":
+        """An empty store of the same backend beside this one, to be filled and then passed to ``swap_in``"""
+        raise NotImplementedError
+
+    def swap_in(self, staging: "VectorStore"):
+        """Replace this store's contents with ``staging``'s, consuming ``staging``"""
+        raise NotImplementedError
+
+    def replace_all(self, ids: List[str], embeddings: np.ndarray, documents: List[str],
+                    metadatas: List[Dict[str, Any]]):
+        """Load the given chunks into a staging store and swap it in, leaving the live data intact on failure"""
+        staging = self.create_staging()
+        staging.bulk_load(ids, embeddings, documents, metadatas)
+        self.swap_in(staging)
+
+    def bulk_load(self, ids: List[str], embeddings: np.ndarray, documents: List[str],
+                  metadatas: List[Dict[str, Any]], batch_size: int = 5000):
+        """Replace the store contents with the given chunks using large batched adds"""
+        self.reset()
+        for start in range(0, len(ids), batch_size):
+            stop = start + batch_size
+            self.add(ids[start:stop], embeddings[start:stop], documents[start:stop], metadatas[start:stop])
+
+class ChromaVectorStore(VectorStore):
+    """Vector store backed by a persistent ChromaDB collection"""
+
+    name = "chroma"
+
+    def __init__(self, config: RAGConfig, client=None):
+        if chromadb is None:
+            raise ImportError("chromadb is required for the 'chroma' vector store backend")
+        self.config = config
+        self.client = client or chromadb.PersistentClient(
+            path=config.chroma_db_path,
+            settings=Settings(
+                anonymized_telemetry=False
+            )
+        )
+        self.collection = self.client.get_or_create_collection(
+            name=config.chroma_collection_name
+        )
+        logger.info(f"Initialized ChromaDB collection: {config.chroma_collection_name}")
+
+    def add(self, ids, embeddings, documents, metadatas) -> int:
+        self.collection.add(
+            embeddings=np.asarray(embeddings, dtype=np.float32),
+            documents=documents,
+            metadatas=[_clean_metadata(m) for m in metadatas],
+            ids=ids
+        )
+        return len(ids)
+
+    def query(self, query_embeddings, k, where=None):
+        query_embeddings = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        results = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=k,
+            where=where or None,
+            include=["documents", "metadatas", "distances"]
+        )
+        if not results["ids"]:
+            return [[] for _ in range(len(query_embeddings))]
+        return [
+            list(zip(ids, documents, metadatas, distances))
+            for ids, documents, metadatas, distances in zip(
+                results["ids"], results["documents"], results["metadatas"], results["distances"]
+            )
+        ]
+
+    def get(self, ids):
+        if not ids:
+            return []
+        results = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        return list(zip(results["ids"], results["documents"], results["metadatas"]))
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": self.name, "path": self.config.chroma_db_path, "collection": self.config.chroma_collection_name}
+
+    def export_all(self, batch_size: int = 5000):
+        ids, embeddings, documents, metadatas = [], [], [], []
+        for offset in range(0, self.collection.count(), batch_size):
+            batch = self.collection.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+            ids.extend(batch["ids"])
+            embeddings.append(np.asarray(batch["embeddings"], dtype=np.float32))
+            documents.extend(batch["documents"])
+            metadatas.extend(batch["metadatas"])
+        if not embeddings:
+            return [], np.empty((0, self.config.vector_dim), dtype=np.float32), [], []
+        return ids, np.vstack(embeddings), documents, metadatas
+
+    def create_staging(self) -> "ChromaVectorStore":
+        staging = ChromaVectorStore(
+            replace(self.config, chroma_collection_name=f"{self.config.chroma_collection_name}_staging"), self.client
+        )
+        staging.reset()
+        return staging
+
+    def swap_in(self, staging: "ChromaVectorStore"):
+        # Renames keep the live collection intact until the staged one has taken its name
+        name = self.config.chroma_collection_name
+        self.collection.modify(name=f"{name}_old")
+        staging.collection.modify(name=name)
+        self.client.delete_collection(name=f"{name}_old")
+        self.collection = staging.collection
+
+    def reset(self):
+        self.client.delete_collection(name=self.config.chroma_collection_name)
+        self.collection = self.client.create_collection(
+            name=self.config.chroma_collection_name,
+            metadata={"description": "Document chunks for RAG system"}
+        )
+
+class LocalVectorStore(VectorStore):
+    """In-process vector index over memory-mapped float16/int8 embeddings with optional IVF search"""
+
+    # Layout under local_index_path: manifest.json (sizes, column vocabularies), vectors.bin,
+    # scales.bin (int8 only), ids.txt, records.jsonl read lazily via offsets.bin, one int32
+    # dictionary-code file per metadata field (col_<n>.bin, -1 = absent) and ivf.npz.
+    name = "local"
+    _BLOCK_ROWS = 65536
+    _ID_FIELD = "chunk_id"  # filtered through the id table rather than a metadata column
+    _FORMAT_VERSION = 2
+
+    def __init__(self, config: RAGConfig):
+        self.config = config
+        self.path = Path(config.local_index_path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dtype = np.dtype(config.local_index_dtype)
+        if self.dtype not in (np.dtype(np.float16), np.dtype(np.int8)):
+            raise ValueError(f"Unsupported local index dtype: {config.local_index_dtype}")
+        # Searches share the read lock; add/reset/bulk_load remap files under the write lock
+        self._lock = ReadWriteLock()
+        self._load()
+        logger.info(f"Opened local vector index at {self.path} with {self.count()} chunks")
+
+    # --- persistence ---
+
+    def _clear_state(self):
+        self.dim: Optional[int] = None
+        self._ids: List[str] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._ids_bytes = 0
+        self._records_bytes = 0
+        self._vocab: Dict[str, List[Any]] = {}
+        self._vocab_index: Dict[str, Dict[Any, int]] = {}
+        self._columns: Dict[str, np.ndarray] = {}
+        self._offsets: Optional[np.ndarray] = None
+        self._records: Optional[np.ndarray] = None
+        self._vectors: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._centroids: Optional[np.ndarray] = None
+        self._assign: Optional[np.ndarray] = None
+        self._lists: List[np.ndarray] = []
+        self._trained_count = 0
+
+    def _close_files(self):
+        self._vectors = self._scales = self._offsets = self._records = None
+        self._columns = {}
+
+    def _load(self):
+        self._clear_state()
+        manifest_path = self.path / "manifest.json"
+        if not manifest_path.exists():
+            return
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != self._FORMAT_VERSION:
+            raise ValueError(f"Local index at {self.path} uses format {manifest.get('version')}; "
+                             f"rebuild it or restore it from a snapshot")
+        if manifest["dtype"] != self.dtype.name:
+            raise ValueError(f"Local index at {self.path} stores {manifest['dtype']} vectors, "
+                             f"but {self.dtype.name} was configured")
+        if manifest.get("embedding_model") != self.config.embedding_model:
+            raise ValueError(f"Local index at {self.path} was built with {manifest.get('embedding_model')}, "
+                             f"but {self.config.embedding_model} was configured")
+        self.dim = manifest["dim"]
+        count = manifest["count"]
+        self._ids_bytes = manifest["ids_bytes"]
+        self._records_bytes = manifest["records_bytes"]
+
+        # Drop anything written after the last manifest update (e.g. an interrupted add)
+        self._truncate(self.path / "vectors.bin", count * self.dim * self.dtype.itemsize)
+        if self.dtype == np.int8:
+            self._truncate(self.path / "scales.bin", count * 4)
+        self._truncate(self.path / "offsets.bin", count * 8)
+        self._truncate(self.path / "ids.txt", self._ids_bytes)
+        self._truncate(self.path / "records.jsonl", self._records_bytes)
+        for n, column in enumerate(manifest["columns"]):
+            self._truncate(self._column_path(n), count * 4)
+            self._vocab[column["field"]] = column["vocab"]
+            self._vocab_index[column["field"]] = {value: code for code, value in enumerate(column["vocab"])}
+        for stray in self.path.glob("col_*.bin"):
+            if int(stray.stem.split("_")[1]) >= len(manifest["columns"]):
+                stray.unlink()
+
+        if count:
+            with open(self.path / "ids.txt", "r", encoding="utf-8") as f:
+                self._ids = f.read().split("\n")[:count]
+        self._id_to_row = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        self._map_files()
+
+        ivf_path = self.path / "ivf.npz"
+        if ivf_path.exists():
+            ivf = np.load(ivf_path)
+            if len(ivf["assign"]) == count:
+                self._centroids = ivf["centroids"]
+                self._assign = ivf["assign"]
+                self._trained_count = int(ivf["trained_count"])
+                self._rebuild_lists()
+        if self._centroids is None:
+            self._update_ivf(0)
+
+    @staticmethod
+    def _truncate(path: Path, size: int):
+        if path.exists() and path.stat().st_size > size:
+            os.truncate(path, size)
+
+    def _column_path(self, n: int) -> Path:
+        return self.path / f"col_{n}.bin"
+
+    def _write_manifest(self):
+        manifest = {
+            "version": self._FORMAT_VERSION,
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "count": len(self._ids),
+            "ids_bytes": self._ids_bytes,
+            "records_bytes": self._records_bytes,
+            "embedding_model": self.config.embedding_model,
+            "columns": [{"field": field, "vocab": vocab} for field, vocab in self._vocab.items()],
+        }
+        tmp_path = self.path / "manifest.json.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.path / "manifest.json")
+
+    def _map_files(self):
+        self._close_files()
+        count = len(self._ids)
+        if count == 0:
+            return
+        self._vectors = np.memmap(self.path / "vectors.bin", dtype=self.dtype, mode="r", shape=(count, self.dim))
+        if self.dtype == np.int8:
+            self._scales = np.memmap(self.path / "scales.bin", dtype=np.float32, mode="r", shape=(count,))
+        self._offsets = np.memmap(self.path / "offsets.bin", dtype=np.int64, mode="r", shape=(count,))
+        for n, field in enumerate(self._vocab):
+            self._columns[field] = np.memmap(self._column_path(n), dtype=np.int32, mode="r", shape=(count,))
+        self._records = np.memmap(self.path / "records.jsonl", dtype=np.uint8, mode="r", shape=(self._records_bytes,))
+
+    def _read_records(self, rows) -> List[Tuple[str, Dict[str, Any]]]:
+        """Read (document, metadata) for the given rows from the mapped records file"""
+        records = []
+        for row in rows:
+            start = int(self._offsets[row])
+            stop = int(self._offsets[row + 1]) if row + 1 < len(self._offsets) else self._records_bytes
+            record = json.loads(self._records[start:stop].tobytes())
+            records.append((record["document"], record["metadata"]))
+        return records
+
+    def _code(self, field: str, value: Any) -> int:
+        if value is None:
+            return -1
+        index = self._vocab_index.setdefault(field, {})
+        if value not in index:
+            index[value] = len(index)
+            self._vocab.setdefault(field, []).append(value)
+        return index[value]
+
+    # --- encoding ---
+
+    def _encode(self, embeddings: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        unit = vectors / norms
+        if self.dtype == np.float16:
+            return unit.astype(np.float16), None
+        scales = np.abs(unit).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.round(unit / scales[:, None]).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+
+    def _decode(self, rows) -> np.ndarray:
+        """Dequantise a slice or sorted index array of rows to float32"""
+        block = np.asarray(self._vectors[rows], dtype=np.float32)
+        if self._scales is not None:
+            block *= self._scales[rows][:, None]
+        return block
+
+    # --- IVF index ---
+
+    def _rebuild_lists(self):
+        order = np.argsort(self._assign, kind="stable")
+        bounds = np.cumsum(np.bincount(self._assign, minlength=len(self._centroids)))[:-1]
+        self._lists = np.split(order, bounds)
+
+    def _nearest_centroids(self, start: int, stop: int) -> np.ndarray:
+        assign = []
+        for block_start in range(start, stop, self._BLOCK_ROWS):
+            block = self._decode(slice(block_start, min(block_start + self._BLOCK_ROWS, stop)))
+            assign.append(np.argmax(block @ self._centroids.T, axis=1).astype(np.int32))
+        return np.concatenate(assign) if assign else np.empty(0, dtype=np.int32)
+
+    def _train_ivf(self):
+        count = len(self._ids)
+        nlist = min(self.config.ivf_nlist, count)
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(count, size=min(count, nlist * 64), replace=False))
+        sample = self._decode(sample_rows)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(10):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[labels == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = centroids / norms
+        self._centroids = centroids.astype(np.float32)
+        self._assign = self._nearest_centroids(0, count)
+        self._trained_count = count
+        logger.info(f"Trained IVF index with {nlist} lists over {count} chunks")
+
+    def _update_ivf(self, start_row: int):
+        count = len(self._ids)
+        if count < self.config.ivf_min_train_size:
+            return
+        if self._centroids is None or count >= 2 * self._trained_count:
+            self._train_ivf()
+        else:
+            self._assign = np.concatenate([self._assign, self._nearest_centroids(start_row, count)])
+        self._rebuild_lists()
+        np.savez(self.path / "ivf.npz", centroids=self._centroids, assign=self._assign,
+                 trained_count=self._trained_count)
+
+    # --- public API ---
+
+    def add(self, ids, embeddings, documents, metadatas) -> int:
+        with self._lock.write():
+            return self._add(ids, embeddings, documents, metadatas)
+
+    def _add(self, ids, embeddings, documents, metadatas) -> int:
+        embeddings = np.asarray(embeddings)
+        if embeddings.ndim != 2 or len(embeddings) != len(ids):
+            raise ValueError("Embeddings must be a 2-D array with one row per id")
+        if self.dim is None:
+            self.dim = int(embeddings.shape[1])
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match index dimension {self.dim}")
+
+        seen = set()
+        keep = []
+        for i, chunk_id in enumerate(ids):
+            if chunk_id not in self._id_to_row and chunk_id not in seen:
+                seen.add(chunk_id)
+                keep.append(i)
+        if not keep:
+            return 0
+        if len(keep) < len(ids):
+            embeddings = embeddings[keep]
+
+        encoded, scales = self._encode(embeddings)
+        metadatas = [_clean_metadata(metadatas[i]) for i in keep]
+        start_row = len(self._ids)
+        with open(self.path / "vectors.bin", "ab") as f:
+            encoded.tofile(f)
+        if scales is not None:
+            with open(self.path / "scales.bin", "ab") as f:
+                scales.tofile(f)
+
+        offsets = []
+        position = self._records_bytes
+        with open(self.path / "records.jsonl", "ab") as f:
+            for i, metadata in zip(keep, metadatas):
+                line = (json.dumps({"document": documents[i], "metadata": metadata}) + "\n").encode("utf-8")
+                f.write(line)
+                offsets.append(position)
+                position += len(line)
+        with open(self.path / "offsets.bin", "ab") as f:
+            np.asarray(offsets, dtype=np.int64).tofile(f)
+        ids_text = "".join(ids[i] + "\n" for i in keep).encode("utf-8")
+        with open(self.path / "ids.txt", "ab") as f:
+            f.write(ids_text)
+
+        # Append one dictionary-coded column per metadata field, backfilling new fields
+        for metadata in metadatas:
+            for field in metadata:
+                if field == self._ID_FIELD:
+                    continue
+                self._vocab.setdefault(field, [])
+                self._vocab_index.setdefault(field, {})
+        for n, field in enumerate(self._vocab):
+            codes = np.fromiter((self._code(field, m.get(field)) for m in metadatas), dtype=np.int32, count=len(metadatas))
+            column_path = self._column_path(n)
+            with open(column_path, "ab") as f:
+                missing_rows = start_row - f.tell() // 4
+                if missing_rows > 0:
+                    np.full(missing_rows, -1, dtype=np.int32).tofile(f)
+                codes.tofile(f)
+
+        for i in keep:
+            self._id_to_row[ids[i]] = len(self._ids)
+            self._ids.append(ids[i])
+        self._ids_bytes += len(ids_text)
+        self._records_bytes = position
+
+        self._map_files()
+        self._update_ivf(start_row)
+        self._write_manifest()
+        return len(keep)
+
+    def query(self, query_embeddings, k, where=None):
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        with self._lock.read():
+            if not self._ids:
+                return [[] for _ in range(len(queries))]
+            norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            queries = queries / norms
+
+            allowed = self._filter_rows(where)
+            if allowed is not None and allowed.size == 0:
+                return [[] for _ in range(len(queries))]
+
+            if self._centroids is None or (allowed is not None and allowed.size <= self.config.ivf_min_train_size):
+                rows, scores = self._exact_search(queries, k, allowed)
+                hits = list(zip(rows, scores))
+            else:
+                hits = self._ivf_search(queries, k, allowed)
+
+            results = []
+            for query_rows, query_scores in hits:
+                records = self._read_records(query_rows)
+                results.append([
+                    (self._ids[row], document, metadata, max(0.0, float(2.0 - 2.0 * score)))
+                    for row, score, (document, metadata) in zip(query_rows, query_scores, records)
+                ])
+            return results
+
+    def _exact_search(self, queries: np.ndarray, k: int,
+                      rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact top-k over all rows (or a sorted subset), scanning in blocks"""
+        total = len(self._ids) if rows is None else len(rows)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, total, self._BLOCK_ROWS):
+            stop = min(start + self._BLOCK_ROWS, total)
+            if rows is None:
+                block_rows = np.arange(start, stop)
+                block = self._decode(slice(start, stop))
+            else:
+                block_rows = rows[start:stop]
+                block = self._decode(block_rows)
+            scores = queries @ block.T
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_rows = np.concatenate([best_rows, np.broadcast_to(block_rows, scores.shape)], axis=1)
+            if best_scores.shape[1] > k:
+                top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, top, axis=1)
+                best_rows = np.take_along_axis(best_rows, top, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+    def _ivf_search(self, queries: np.ndarray, k: int,
+                    allowed: Optional[np.ndarray]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        nprobe = min(self.config.ivf_nprobe, len(self._centroids))
+        probes = np.argpartition(-(queries @ self._centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        hits = []
+        for query, probe in zip(queries, probes):
+            candidates = np.sort(np.concatenate([self._lists[c] for c in probe]))
+            if allowed is not None:
+                candidates = np.intersect1d(candidates, allowed, assume_unique=True)
+            if candidates.size == 0:
+                hits.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)))
+                continue
+            rows, scores = self._exact_search(query[None, :], k, candidates)
+            hits.append((rows[0], scores[0]))
+        return hits
+
+    def _filter_rows(self, where: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Resolve a Chroma-style ``where`` filter to a sorted array of matching rows"""
+        if not where:
+            return None
+        return np.flatnonzero(self._match(where))
+
+    def _match(self, where: Dict[str, Any]) -> np.ndarray:
+        mask = np.ones(len(self._ids), dtype=bool)
+        for key, condition in where.items():
+            if key == "$and":
+                for clause in condition:
+                    mask &= self._match(clause)
+            elif key == "$or":
+                any_mask = np.zeros(len(self._ids), dtype=bool)
+                for clause in condition:
+                    any_mask |= self._match(clause)
+                mask &= any_mask
+            else:
+                mask &= self._match_field(key, condition)
+        return mask
+
+    def _match_field(self, field: str, condition: Any) -> np.ndarray:
+        if field == self._ID_FIELD:
+            # Every row is its own code, so ids resolve through the id table
+            codes = np.arange(len(self._ids), dtype=np.int32)
+            index = self._id_to_row
+        else:
+            codes = self._columns.get(field)
+            if codes is None:
+                codes = np.full(len(self._ids), -1, dtype=np.int32)
+            index = self._vocab_index.get(field, {})
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        mask = np.ones(len(self._ids), dtype=bool)
+        for op, value in condition.items():
+            if op in ("$eq", "$ne"):
+                matched = codes == index.get(value, -2)
+            elif op in ("$in", "$nin"):
+                matched = np.isin(codes, [index[v] for v in value if v in index])
+            elif op in ("$gt", "$gte", "$lt", "$lte"):
+                # Compare against the distinct values only, then select rows by code
+                matched = np.isin(codes, [code for code, stored in enumerate(self._vocab.get(field, []))
+                                          if _compare(stored, op, value)])
+            else:
+                raise ValueError(f"Unsupported filter operator: {op}")
+            mask &= ~matched if op in ("$ne", "$nin") else matched
+        return mask
+
+    def get(self, ids):
+        with self._lock.read():
+            rows = [self._id_to_row[chunk_id] for chunk_id in ids if chunk_id in self._id_to_row]
+            return [(self._ids[row], document, metadata)
+                    for row, (document, metadata) in zip(rows, self._read_records(rows))]
+
+    def count(self) -> int:
+        return len(self._ids)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": self.name, "path": str(self.path)}
+
+    def export_all(self):
+        with self._lock.read():
+            if not self._ids:
+                return [], np.empty((0, self.dim or self.config.vector_dim), dtype=np.float32), [], []
+            records = [json.loads(line) for line in self._records.tobytes().splitlines()]
+            return (list(self._ids), self._decode(slice(0, len(self._ids))),
+                    [record["document"] for record in records], [record["metadata"] for record in records])
+
+    def bulk_load(self, ids, embeddings, documents, metadatas, batch_size: int = 5000):
+        # One add writes the whole matrix in a single pass and trains IVF once
+        with self._lock.write():
+            self._reset()
+            if ids:
+                self._add(ids, embeddings, documents, metadatas)
+
+    def create_staging(self) -> "LocalVectorStore":
+        staging_path = Path(f"{self.path}.new")
+        # Leftovers of an interrupted rebuild are discarded
+        shutil.rmtree(staging_path, ignore_errors=True)
+        return LocalVectorStore(replace(self.config, local_index_path=str(staging_path)))
+
+    def swap_in(self, staging: "LocalVectorStore"):
+        old_path = Path(f"{self.path}.old")
+        with self._lock.write(), staging._lock.write():
+            staging._close_files()
+            self._close_files()
+            shutil.rmtree(old_path, ignore_errors=True)
+            os.replace(self.path, old_path)
+            try:
+                os.replace(staging.path, self.path)
+            except OSError:
+                os.replace(old_path, self.path)
+                self._load()
+                raise
+            self._load()
+            staging._clear_state()
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    def reset(self):
+        with self._lock.write():
+            self._reset()
+
+    def _reset(self):
+        self._close_files()
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._clear_state()
+
+def _compare(stored: Any, op: str, value: Any) -> bool:
+    try:
+        if op == "$gt":
+            return stored > value
+        if op == "$gte":
+            return stored >= value
+        if op == "$lt":
+            return stored < value
+        return stored <= value
+    except TypeError:
+        return False
+
+class ShardedVectorStore(VectorStore):
+    """Hash-partitions chunks by ``shard_key`` across backend stores and fans searches out in parallel"""
+
+    def __init__(self, config: RAGConfig, backend: type):
+        self.config = config
+        self.name = f"sharded-{backend.name}"
+        self.shards: List[VectorStore] = [
+            backend(replace(
+                config,
+                chroma_collection_name=f"{config.chroma_collection_name}_shard{i}",
+                local_index_path=str(Path(config.local_index_path) / f"shard{i}")
+            ))
+            for i in range(config.num_shards)
+        ]
+        self._locks = [ReadWriteLock() for _ in self.shards]
+        self._executor = ThreadPoolExecutor(max_workers=config.num_shards * config.max_concurrent_queries,
+                                            thread_name_prefix="shard")
+
+    def shard_for(self, chunk_id: str, metadata: Dict[str, Any]) -> int:
+        key = str(metadata.get(self.config.shard_key, chunk_id))
+        return int(hashlib.md5(key.encode()).hexdigest(), 16) % len(self.shards)
+
+    def _target_shards(self, where: Optional[Dict[str, Any]]) -> List[int]:
+        """Shards that can hold matches, using equality/$in conditions on the shard key"""
+        clauses = (where or {}).get("$and", [where] if where else [])
+        for clause in clauses:
+            condition = clause.get(self.config.shard_key)
+            if condition is None:
+                continue
+            if not isinstance(condition, dict):
+                values = [condition]
+            elif set(condition) == {"$eq"}:
+                values = [condition["$eq"]]
+            elif set(condition) == {"$in"}:
+                values = condition["$in"]
+            else:
+                continue
+            return sorted({self.shard_for("", {self.config.shard_key: value}) for value in values})
+        return list(range(len(self.shards)))
+
+    def _partition(self, ids, metadatas) -> Dict[int, List[int]]:
+        groups: Dict[int, List[int]] = {}
+        for i, (chunk_id, metadata) in enumerate(zip(ids, metadatas)):
+            groups.setdefault(self.shard_for(chunk_id, metadata), []).append(i)
+        return groups
+
+    def add(self, ids, embeddings, documents, metadatas) -> int:
+        embeddings = np.asarray(embeddings)
+        futures = [
+            self._executor.submit(
+                self.shards[shard].add,
+                [ids[i] for i in rows], embeddings[rows],
+                [documents[i] for i in rows], [metadatas[i] for i in rows]
+            )
+            for shard, rows in self._partition(ids, metadatas).items()
+        ]
+        return sum(future.result() for future in futures)
+
+    def query(self, query_embeddings, k, where=None):
+        query_embeddings = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        futures = [self._executor.submit(self._query_shard, shard, query_embeddings, k, where)
+                   for shard in self._target_shards(where)]
+        merged = [[] for _ in range(len(query_embeddings))]
+        for future in futures:
+            for hits, shard_hits in zip(merged, future.result()):
+                hits.extend(shard_hits)
+        return [sorted(hits, key=lambda hit: hit[3])[:k] for hits in merged]
+
+    def _query_shard(self, shard: int, query_embeddings, k, where):
+        with self._locks[shard].read():
+            return self.shards[shard].query(query_embeddings, k, where)
+
+    def _get_shard(self, shard: int, ids):
+        with self._locks[shard].read():
+            return self.shards[shard].get(ids)
+
+    def get(self, ids):
+        futures = [self._executor.submit(self._get_shard, shard, ids) for shard in range(len(self.shards))]
+        found = {hit[0]: hit for future in futures for hit in future.result()}
+        return [found[chunk_id] for chunk_id in ids if chunk_id in found]
+
+    def count(self) -> int:
+        return sum(shard.count() for shard in self.shards)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": self.name, "shards": [shard.describe() for shard in self.shards]}
+
+    def shard_counts(self) -> List[int]:
+        return [shard.count() for shard in self.shards]
+
+    def reset(self):
+        for shard in self.shards:
+            shard.reset()
+
+    def rebuild_shard(self, shard: int):
+        """Rebuild one shard from its own contents into a staging copy, then swap it in.
+
+        Callers must serialise this with ingest (``RAGPipeline.rebuild_shard``).
+        Searches keep using the live shard until the short swap.
+        """
+        live = self.shards[shard]
+        with self._locks[shard].read():
+            exported = live.export_all()
+        staging = live.create_staging()
+        staging.bulk_load(*exported)
+        with self._locks[shard].write():
+            live.swap_in(staging)
+
+    def export_all(self):
+        exports = [shard.export_all() for shard in self.shards]
+        non_empty = [e for e in exports if e[0]]
+        if not non_empty:
+            return exports[0]
+        return (
+            [chunk_id for e in non_empty for chunk_id in e[0]],
+            np.vstack([e[1] for e in non_empty]),
+            [document for e in non_empty for document in e[2]],
+            [metadata for e in non_empty for metadata in e[3]],
+        )
+
+    def replace_all(self, ids, embeddings, documents, metadatas):
+        # Stage every shard before swapping any, so a failed load leaves all live shards untouched
+        embeddings = np.asarray(embeddings)
+        groups = self._partition(ids, metadatas)
+        stagings = [shard.create_staging() for shard in self.shards]
+        futures = [
+            self._executor.submit(
+                stagings[shard].bulk_load,
+                [ids[i] for i in groups.get(shard, [])], embeddings[groups.get(shard, [])],
+                [documents[i] for i in groups.get(shard, [])], [metadatas[i] for i in groups.get(shard, [])]
+            )
+            for shard in range(len(self.shards))
+        ]
+        for future in futures:
+            future.result()
+        for shard, staging in enumerate(stagings):
+            with self._locks[shard].write():
+                self.shards[shard].swap_in(staging)
+
+    def _bulk_load_shard(self, shard: int, ids, embeddings, documents, metadatas, batch_size: int):
+        with self._locks[shard].write():
+            self.shards[shard].bulk_load(ids, embeddings, documents, metadatas, batch_size)
+
+    def bulk_load(self, ids, embeddings, documents, metadatas, batch_size: int = 5000):
+        embeddings = np.asarray(embeddings)
+        groups = self._partition(ids, metadatas)
+        futures = [
+            self._executor.submit(
+                self._bulk_load_shard, shard,
+                [ids[i] for i in groups.get(shard, [])], embeddings[groups.get(shard, [])],
+                [documents[i] for i in groups.get(shard, [])], [metadatas[i] for i in groups.get(shard, [])],
+                batch_size
+            )
+            for shard in range(len(self.shards))
+        ]
+        for future in futures:
+            future.result()
+
+VECTOR_STORE_BACKENDS = {
+    ChromaVectorStore.name: ChromaVectorStore,
+    LocalVectorStore.name: LocalVectorStore,
+}
+
+def create_vector_store(config: RAGConfig) -> VectorStore:
+    """Instantiate the vector store backend selected in the config"""
+    try:
+        backend = VECTOR_STORE_BACKENDS[config.vector_store_backend]
+    except KeyError:
+        raise ValueError(f"Unknown vector store backend: {config.vector_store_backend}")
+    if config.num_shards > 1:
+        return ShardedVectorStore(config, backend)
+    return backend(config)